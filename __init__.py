@@ -20,6 +20,22 @@ def load_module(module_name: str, file_path: str):
     return module
 
 
+def load_shared_package(package_name: str = "yarvixpa_shared"):
+    """Register the helper package next to this file so node modules can import it by name."""
+    package_path = Path(__file__).parent / package_name
+    spec = importlib.util.spec_from_file_location(
+        package_name, package_path / "__init__.py",
+        submodule_search_locations=[str(package_path)],
+    )
+    if not spec or not spec.loader:
+        raise ImportError(f"Failed to create spec for {package_name} ({package_path})")
+
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[package_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
 def _module_name_for(path: Path, base_pkg: str, nodes_path: Path) -> str:
     """Convert a file path to a package-style module name (e.g., nodes.sub.package.module)."""
     relative = path.relative_to(nodes_path)  # e.g. 'sub/package/module.py'
@@ -78,6 +94,7 @@ def load_nodes():
 
 
 # Execute the loader
+load_shared_package()
 load_nodes()
 
 # Web configuration: export directory properly
@@ -1,7 +1,8 @@
 import { app } from "../../scripts/app.js";
 import { ComfyWidgets } from "../../scripts/widgets.js";
 
-const NODE_CLASS_NAME = "ShowAnyDataType";
+// Nodos que muestran texto con este widget
+const NODE_CLASS_NAMES = ["ShowAnyDataType", "FluxKVCacheStats"];
 const WIDGET_NAME = "output_display";
 const PLACEHOLDER_TEXT = "Waiting for data...";
 
@@ -100,7 +101,7 @@ app.registerExtension({
     name: "custom.ShowAnyDataTypeExtension",
 
     async beforeRegisterNodeDef(nodeType, nodeData, app) {
-        if (nodeData.name !== NODE_CLASS_NAME) return;
+        if (!NODE_CLASS_NAMES.includes(nodeData.name)) return;
 
         //
         // 1. Nodo creado (nuevo o duplicado)
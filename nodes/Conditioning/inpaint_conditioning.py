@@ -1,5 +1,5 @@
-import torch
-import torch.nn.functional as F
+from yarvixpa_shared.inpaint_encode import DEFAULT_TILE_SIZE, ENCODE_MODES, crop_region, inpaint_encode
+from yarvixpa_shared.latent_cache import DEFAULT_CACHE_MB
 
 def conditioning_set_values(conditioning, values={}):
     c = []
@@ -19,35 +19,26 @@ class InpaintConditioningNode:
                              "pixels": ("IMAGE", ),
                              "mask": ("MASK", ),
                              "noise_mask": ("BOOLEAN", {"default": True, "tooltip": "Add a noise mask to the latent so sampling will only happen within the mask. Might improve results or completely break things depending on the model."})
+                             },
+                "optional": {"crop_to_mask": ("BOOLEAN", {"default": False, "tooltip": "Encode and sample only the bounding box of the mask plus context padding. Use Inpaint Uncrop to paste the decoded result back into the full image."}),
+                             "context_padding": ("INT", {"default": 64, "min": 0, "max": 4096, "step": 8, "tooltip": "Pixels of context kept around the mask when crop_to_mask is on. The region is snapped to the 8 px latent grid."}),
+                             "cache_mb": ("INT", {"default": DEFAULT_CACHE_MB, "min": 0, "max": 65536, "step": 64, "tooltip": "RAM budget of the shared latent cache, so re-running with the same image, mask and VAE skips the encode. 0 disables it."}),
+                             "encode_mode": (ENCODE_MODES, {"default": "auto", "tooltip": "auto: ComfyUI's VAE encode, which retries tiled by itself when it runs out of memory (smaller tiles are tried if that fails too). tiled: always encode in tiles, starting at tile_size."}),
+                             "tile_size": ("INT", {"default": DEFAULT_TILE_SIZE, "min": 128, "max": 4096, "step": 64, "tooltip": "Starting tile size for tiled encoding; halved automatically while it still runs out of memory."}),
                              }}
 
-    RETURN_TYPES = ("CONDITIONING", "CONDITIONING", "LATENT")
-    RETURN_NAMES = ("positive", "negative", "latent")
+    RETURN_TYPES = ("CONDITIONING", "CONDITIONING", "LATENT", "INPAINT_CROP")
+    RETURN_NAMES = ("positive", "negative", "latent", "crop")
     FUNCTION = "encode"
     CATEGORY = "ComfyUI-YarvixPA/Conditioning/Inpaint"
     DESCRIPTION = ""
 
-    def encode(self, positive, negative, pixels, vae, mask, noise_mask):
-        x = (pixels.shape[1] // 8) * 8
-        y = (pixels.shape[2] // 8) * 8
-        mask = F.interpolate(mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])), size=(pixels.shape[1], pixels.shape[2]), mode="bilinear")
+    def encode(self, positive, negative, pixels, vae, mask, noise_mask, crop_to_mask=False, context_padding=64, cache_mb=DEFAULT_CACHE_MB,
+               encode_mode="auto", tile_size=DEFAULT_TILE_SIZE):
+        pixels, mask, crop = crop_region(pixels, mask, context_padding if crop_to_mask else None)
 
-        orig_pixels = pixels
-        pixels = orig_pixels.clone()
-        if pixels.shape[1] != x or pixels.shape[2] != y:
-            x_offset = (pixels.shape[1] % 8) // 2
-            y_offset = (pixels.shape[2] % 8) // 2
-            pixels = pixels[:, x_offset:x + x_offset, y_offset:y + y_offset, :]
-            mask = mask[:, :, x_offset:x + x_offset, y_offset:y + y_offset]
-
-        m = (1.0 - mask.round()).squeeze(1)
-        for i in range(3):
-            pixels[:, :, :, i] -= 0.5
-            pixels[:, :, :, i] *= m
-            pixels[:, :, :, i] += 0.5
-
-        concat_latent = vae.encode(pixels)
-        orig_latent = vae.encode(orig_pixels)
+        # Masked and original images share one batched VAE call
+        concat_latent, orig_latent, mask = inpaint_encode(vae, pixels, mask, cache_mb, encode_mode, tile_size, box=crop["box"])
 
         out_latent = {}
         out_latent["samples"] = orig_latent
@@ -59,7 +50,7 @@ class InpaintConditioningNode:
             c = conditioning_set_values(conditioning, {"concat_latent_image": concat_latent,
                                                        "concat_mask": mask})
             out.append(c)
-        return (out[0], out[1], out_latent)
+        return (out[0], out[1], out_latent, crop)
 
 NODE_CLASS_MAPPINGS = {
     "InpaintConditioningNode": InpaintConditioningNode
@@ -0,0 +1,53 @@
+import torch.nn.functional as F
+import comfy.utils
+
+class InpaintUncrop:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {
+            "crop": ("INPAINT_CROP", {"forceInput": True}),
+            "image": ("IMAGE", {"tooltip": "Full image that was passed to the inpaint conditioning node."}),
+            "decoded": ("IMAGE", {"tooltip": "Decoded result of the cropped region."}),
+            "blend_with_mask": ("BOOLEAN", {"default": True, "tooltip": "Only replace masked pixels; keep the original context around them."}),
+            "feather": ("INT", {"default": 8, "min": 0, "max": 256, "step": 1, "tooltip": "Softens the mask edge by this many pixels when blending."}),
+        }}
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("IMAGE",)
+    FUNCTION = "uncrop"
+    CATEGORY = "ComfyUI-YarvixPA/Conditioning/Inpaint"
+    DESCRIPTION = "Pastes a decoded inpaint region back into the full image using the crop from an inpaint conditioning node."
+
+    def uncrop(self, crop, image, decoded, blend_with_mask, feather):
+        if tuple(image.shape[1:3]) != tuple(crop["size"]):
+            raise ValueError(f"Image is {image.shape[2]}x{image.shape[1]} but the crop was taken from a "
+                             f"{crop['size'][1]}x{crop['size'][0]} image.")
+        top, left, bottom, right = crop["box"]
+        h, w = bottom - top, right - left
+        decoded = decoded[:, :, :, :3].to(image.device, image.dtype)
+        # The VAE may round the region differently; bring it back to the box size
+        if decoded.shape[1] != h or decoded.shape[2] != w:
+            decoded = comfy.utils.common_upscale(decoded.movedim(-1, 1), w, h, "bilinear", "disabled").movedim(1, -1)
+
+        # Align batch counts (a single source image is reused for every result)
+        if image.shape[0] == 1 and decoded.shape[0] > 1:
+            image = image.expand(decoded.shape[0], -1, -1, -1)
+        out = image.clone()
+        region = out[:, top:bottom, left:right, :3]
+
+        if blend_with_mask and crop.get("mask") is not None:
+            m = crop["mask"].to(image.device, image.dtype).round().unsqueeze(1)
+            if feather > 0:
+                m = F.avg_pool2d(m, 2 * feather + 1, stride=1, padding=feather, count_include_pad=False)
+            region.lerp_(decoded, m.movedim(1, -1))
+        else:
+            region.copy_(decoded)
+        return (out,)
+
+NODE_CLASS_MAPPINGS = {
+    "InpaintUncrop": InpaintUncrop
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "InpaintUncrop": "🚀 Inpaint Uncrop"
+}
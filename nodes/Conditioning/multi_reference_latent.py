@@ -1,5 +1,8 @@
 import node_helpers
 
+from yarvixpa_shared.inpaint_encode import DEFAULT_TILE_SIZE, ENCODE_MODES, encode_cached
+from yarvixpa_shared.latent_cache import DEFAULT_CACHE_MB
+
 
 class MultiReferenceLatent:
     """
@@ -7,7 +10,10 @@ class MultiReferenceLatent:
     reference images into a single node.
 
     For each connected image the node:
-      1. VAE-encodes the image into a latent.
+      1. VAE-encodes the image into a latent (through the shared latent
+         cache, keyed by image content and VAE weights, optionally
+         persisted to disk). Images of the same size are encoded together
+         in one batched VAE call.
       2. Appends `reference_latents` to both positive and negative conditioning.
 
     The number of image inputs is controlled by the `references` widget
@@ -29,6 +35,30 @@ class MultiReferenceLatent:
                 }),
                 "image1": ("IMAGE", {"tooltip": "Reference image 1."}),
             },
+            "optional": {
+                "cache_mb": ("INT", {
+                    "default": DEFAULT_CACHE_MB,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 64,
+                    "tooltip": "RAM budget of the latent cache shared with the inpaint nodes, reused across runs for the same image and VAE. 0 disables the in-memory cache.",
+                }),
+                "persist_to_disk": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Also keep encoded references as safetensors files in the user directory so they survive restarts.",
+                }),
+                "encode_mode": (ENCODE_MODES, {
+                    "default": "auto",
+                    "tooltip": "auto: ComfyUI's VAE encode, which retries tiled by itself when it runs out of memory (smaller tiles are tried if that fails too). tiled: always encode in tiles, starting at tile_size.",
+                }),
+                "tile_size": ("INT", {
+                    "default": DEFAULT_TILE_SIZE,
+                    "min": 128,
+                    "max": 4096,
+                    "step": 64,
+                    "tooltip": "Starting tile size for tiled encoding; halved automatically while it still runs out of memory.",
+                }),
+            },
         }
 
     RETURN_TYPES = ("CONDITIONING", "CONDITIONING")
@@ -41,15 +71,13 @@ class MultiReferenceLatent:
         "Replaces chaining multiple VAE Encode + ReferenceLatent nodes."
     )
 
-    def execute(self, positive, negative, vae, references, **kwargs):
-        for i in range(1, references + 1):
-            image = kwargs.get(f"image{i}")
-            if image is None:
-                continue
-
-            # VAE encode the image
-            latent = vae.encode(image)
+    def execute(self, positive, negative, vae, references, cache_mb=DEFAULT_CACHE_MB, persist_to_disk=False,
+                encode_mode="auto", tile_size=DEFAULT_TILE_SIZE, **kwargs):
+        images = [kwargs.get(f"image{i}") for i in range(1, references + 1)]
+        images = [image for image in images if image is not None]
 
+        # VAE encode the images, batching same-sized ones and reusing previous encodes
+        for latent in encode_cached(vae, images, cache_mb, persist_to_disk, encode_mode, tile_size):
             # Append reference latent to both conditionings
             positive = node_helpers.conditioning_set_values(
                 positive, {"reference_latents": [latent]}, append=True
@@ -1,6 +1,124 @@
 # Flux KV Cache node optimized for GGUF models with partial loading/offloading
-import torch
+import os
+import json
+import time
+import uuid
+import hashlib
 import logging
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+import torch
+from comfy import model_management
+import folder_paths
+
+
+# Cross-prompt store of reference K/V, kept on CPU and keyed by
+# (model identity, reference token layout, reference content hash, compression).
+# Lets batch runs that only change the prompt or seed skip the step-0 rebuild.
+_PERSISTENT_KV = OrderedDict()
+
+
+def _tensor_digest(t):
+    data = t.detach().contiguous().view(torch.uint8).cpu().numpy()
+    return hashlib.sha1(data.tobytes()).hexdigest()
+
+
+class QuantizedKV:
+    """
+    Compressed K/V slice: int8 or fp8 values with one float32 scale per
+    (batch, head), so that value ~= data * scale. Dequantized on retrieval.
+    """
+    FP8_MAX = 448.0
+
+    def __init__(self, data, scale):
+        self.data = data
+        self.scale = scale
+
+    @classmethod
+    def quantize(cls, t, fmt):
+        amax = t.detach().abs().amax(dim=(2, 3), keepdim=True).float().clamp(min=1e-8)
+        if fmt == "fp8":
+            scale = amax / cls.FP8_MAX
+            return cls((t.float() / scale).to(torch.float8_e4m3fn), scale)
+        scale = amax / 127.0
+        return cls((t.float() / scale).round_().clamp_(-127, 127).to(torch.int8), scale)
+
+    def dequantize(self, dtype):
+        return self.data.to(dtype) * self.scale.to(dtype)
+
+    def map(self, fn):
+        return QuantizedKV(fn(self.data), fn(self.scale))
+
+    def tensors(self):
+        return (self.data, self.scale)
+
+
+def _map(t, fn):
+    return t.map(fn) if isinstance(t, QuantizedKV) else fn(t)
+
+
+def _tensors(t):
+    return t.tensors() if isinstance(t, QuantizedKV) else (t,)
+
+
+def _nbytes(t):
+    return sum(x.nelement() * x.element_size() for x in _tensors(t))
+
+
+def _cache_nbytes(cache):
+    return sum(_nbytes(t) for kv in cache.values() for t in kv)
+
+
+def _batch_identical(t):
+    # Persistent-store entries come back already deduplicated and possibly quantized
+    if isinstance(t, QuantizedKV):
+        return False
+    return t.shape[0] > 1 and torch.equal(t, t[:1].expand_as(t))
+
+
+def _remove_files(paths):
+    """Delete the given files, ignoring ones that are gone or still in use, and empty the list."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    paths.clear()
+
+
+def _to_pinned(t):
+    buf = torch.empty(t.shape, dtype=t.dtype, device="cpu", pin_memory=True)
+    buf.copy_(t)
+    return buf
+
+
+# Most recently created cache, read by the stats node
+_LAST_CACHE = None
+
+
+def _new_stats():
+    return {"hits": 0, "misses": 0, "rebuilds": 0, "persistent_hits": 0, "deduped_blocks": 0,
+            "h2d_bytes": 0, "transfer_time_s": 0.0, "concat_time_s": 0.0}
+
+
+# Headroom left free on each tier when the tiered cache places blocks
+TIER_RESERVE = 1024 * 1024 * 1024
+
+
+def _store_persistent(key, cache, budget_bytes):
+    nbytes = _cache_nbytes(cache)
+    if nbytes > budget_bytes:
+        return
+    to_cpu = lambda t: t.to("cpu")
+    entry = {name: (_map(kk, to_cpu), _map(vv, to_cpu)) for name, (kk, vv) in cache.items()}
+    _PERSISTENT_KV[key] = (entry, nbytes)
+    _PERSISTENT_KV.move_to_end(key)
+    total = sum(nbytes for _, nbytes in _PERSISTENT_KV.values())
+    # Evict least recently used entries
+    while total > budget_bytes:
+        _, (_, nbytes) = _PERSISTENT_KV.popitem(last=False)
+        total -= nbytes
 
 
 class GGUF_KV_Attn_Input:
@@ -14,13 +132,311 @@ class GGUF_KV_Attn_Input:
       a generation. A new cache object is created per generation.
     - Uses a hash of reference token info to detect when references change,
       only then does it invalidate the cache
+    - Optionally shares finished caches across prompts through a CPU store
+      keyed by the content of the reference tokens (see lookup_persistent)
+    - With a CUDA compute device, the CPU cache lives in pinned memory in the
+      compute dtype and block i+1 is prefetched on a side stream while block i
+      runs; other devices fall back to plain synchronous copies
+    - In tiered mode each block is placed on the GPU (within a VRAM budget),
+      in CPU RAM, or in a memory-mapped spill file, based on the free memory
+      model_management reports when the block is built
+    - Optionally stores K/V as per-head scaled int8 or fp8 (see QuantizedKV)
+    - Optionally keeps a persistent [B, H, N_img + N_ref, D] buffer per block
+      and input shape on the compute device: the reference part is written once and each step
+      only copies the fresh tokens in, instead of two torch.cat per block
+    - When every batch item (e.g. cond/uncond under CFG) carries identical
+      reference K/V for a block, stores a single copy and expands it as a
+      broadcast view on retrieval
+    - Keeps counters in `stats` (hits, misses, rebuilds, host-to-device bytes,
+      transfer/concat time measured with CUDA events on GPU) for the Flux
+      KV Cache Stats node
     """
-    def __init__(self, cache_device="cpu"):
+    def __init__(self, cache_device="cpu", model_key=None, persistent_budget=0,
+                 tiered=False, vram_budget=0, disk_spill=False, compression="none",
+                 preallocate=False):
         self.cache = {}
         self.cache_device = torch.device(cache_device)
         self._ref_hash = None
         self.set_cache = False
         self._logged_build = False
+        self.model_key = model_key
+        self.persistent_budget = persistent_budget
+        self._pending_key = None
+        self._prefetched = {}
+        self._next_key = {}
+        self._stream = None
+        self.tiered = tiered
+        self.vram_budget = vram_budget
+        self.disk_spill = disk_spill
+        self.tiers = {}
+        self._tier_bytes = {"gpu": 0, "cpu": 0, "disk": 0}
+        self._spill_files = []
+        self._spill_count = 0
+        self._spill_id = uuid.uuid4().hex
+        # execute() replaces this object every prompt without calling anything on it
+        weakref.finalize(self, _remove_files, self._spill_files)
+        self._logged_summary = False
+        if compression == "fp8" and not hasattr(torch, "float8_e4m3fn"):
+            logging.warning("Flux KV Cache (GGUF): fp8 is not available in this PyTorch build, using int8")
+            compression = "int8"
+        self.compression = compression
+        self.preallocate = preallocate
+        self._buffers = {}
+        self.stats = _new_stats()
+        self._pending_timings = []
+        global _LAST_CACHE
+        _LAST_CACHE = weakref.ref(self)
+        self.compression_stats = {"raw_bytes": 0, "stored_bytes": 0, "max_abs_err": 0.0, "sq_err": 0.0, "numel": 0}
+
+    def _reset(self):
+        self.cache = {}
+        self._buffers = {}
+        self._prefetched = {}
+        self._next_key = {}
+        self.tiers = {}
+        self._tier_bytes = {"gpu": 0, "cpu": 0, "disk": 0}
+        self._logged_summary = False
+        self.compression_stats = {"raw_bytes": 0, "stored_bytes": 0, "max_abs_err": 0.0, "sq_err": 0.0, "numel": 0}
+        _remove_files(self._spill_files)
+
+    def _place(self, nbytes, device):
+        """Tier for a new block: GPU while within budget, then CPU RAM, then disk."""
+        if device.type == "cuda" and self._tier_bytes["gpu"] + nbytes <= self.vram_budget \
+                and nbytes < model_management.get_free_memory(device) - TIER_RESERVE:
+            return "gpu"
+        if not self.disk_spill or nbytes < model_management.get_free_memory(torch.device("cpu")) - TIER_RESERVE:
+            return "cpu"
+        return "disk"
+
+    def _spill(self, t):
+        temp_dir = folder_paths.get_temp_directory()
+        os.makedirs(temp_dir, exist_ok=True)
+        path = os.path.join(temp_dir, f"flux_kv_{self._spill_id}_{self._spill_count}.bin")
+        self._spill_count += 1
+        mapped = torch.from_file(path, shared=True, size=t.nelement(), dtype=t.dtype).view(t.shape)
+        mapped.copy_(t)
+        # The mapping outlives the directory entry on POSIX; elsewhere the file
+        # is removed on rebuild or when this object is collected
+        try:
+            os.remove(path)
+        except OSError:
+            self._spill_files.append(path)
+        return mapped
+
+    def _compress(self, t):
+        if self.compression == "none" or isinstance(t, QuantizedKV):
+            return t
+        q = QuantizedKV.quantize(t, self.compression)
+        err = (q.dequantize(torch.float32) - t.float()).abs()
+        stats = self.compression_stats
+        stats["raw_bytes"] += _nbytes(t)
+        stats["stored_bytes"] += _nbytes(q)
+        stats["max_abs_err"] = max(stats["max_abs_err"], err.max().item())
+        stats["sq_err"] += err.square().sum().item()
+        stats["numel"] += err.nelement()
+        return q
+
+    def _store(self, cache_key, k_ref, v_ref, device):
+        # Identical references across the batch: keep one copy
+        if _batch_identical(k_ref) and _batch_identical(v_ref):
+            k_ref, v_ref = k_ref[:1], v_ref[:1]
+            self.stats["deduped_blocks"] += 1
+        k_ref, v_ref = self._compress(k_ref), self._compress(v_ref)
+        if self.tiered:
+            nbytes = _nbytes(k_ref) + _nbytes(v_ref)
+            tier = self._place(nbytes, device)
+            self.tiers[cache_key] = tier
+            self._tier_bytes[tier] += nbytes
+            if tier == "gpu":
+                to_gpu = lambda t: t.to(device, copy=True)
+                return (_map(k_ref, to_gpu), _map(v_ref, to_gpu))
+            if tier == "disk":
+                return (_map(k_ref, self._spill), _map(v_ref, self._spill))
+        elif self.cache_device.type != "cpu":
+            to_cache = lambda t: t.detach().to(self.cache_device)
+            return (_map(k_ref, to_cache), _map(v_ref, to_cache))
+        # Pinned host memory makes the later host-to-device copies asynchronous
+        if torch.cuda.is_available():
+            pin = lambda t: t if t.is_pinned() else _to_pinned(t)
+            return (_map(k_ref, pin), _map(v_ref, pin))
+        to_cpu = lambda t: t.detach().to("cpu")
+        return (_map(k_ref, to_cpu), _map(v_ref, to_cpu))
+
+    def _prefetch(self, cache_key, device):
+        # Only pinned host entries benefit from an asynchronous copy
+        if cache_key is None or cache_key in self._prefetched or not _tensors(self.cache[cache_key][0])[0].is_pinned():
+            return
+        if self._stream is None:
+            self._stream = torch.cuda.Stream(device)
+        to_device = lambda t: t.to(device=device, non_blocking=True)
+        self.stats["h2d_bytes"] += sum(_nbytes(t) for t in self.cache[cache_key])
+        with torch.cuda.stream(self._stream):
+            kk, vv = (_map(t, to_device) for t in self.cache[cache_key])
+            event = torch.cuda.Event()
+            event.record(self._stream)
+        self._prefetched[cache_key] = (kk, vv, event)
+
+    @contextmanager
+    def _timed(self, stat, device):
+        """
+        Add the time of the enclosed GPU work to stats[stat]. On CUDA the work
+        is asynchronous, so it is bracketed by timing events on the compute
+        stream and read back later (see _collect_timings) instead of
+        measuring launch overhead on the host.
+        """
+        if device.type != "cuda":
+            start = time.perf_counter()
+            yield
+            self.stats[stat] += time.perf_counter() - start
+            return
+        stream = torch.cuda.current_stream(device)
+        start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+        start.record(stream)
+        yield
+        end.record(stream)
+        self._pending_timings.append((stat, start, end))
+        if len(self._pending_timings) >= 512:
+            self._collect_timings(wait=False)
+
+    def _collect_timings(self, wait=True):
+        """Fold finished timing events into stats; with wait, block until all are done."""
+        pending = []
+        for stat, start, end in self._pending_timings:
+            if wait:
+                end.synchronize()
+            elif not end.query():
+                pending.append((stat, start, end))
+                continue
+            self.stats[stat] += start.elapsed_time(end) / 1000.0
+        self._pending_timings = pending
+
+    def _fetch(self, cache_key, device, dtype):
+        # Includes waiting for a prefetch issued on the side stream, as seen by the compute stream
+        with self._timed("transfer_time_s", device):
+            kk, vv = self._fetch_to_device(cache_key, device)
+            kk, vv = self._restore(kk, dtype), self._restore(vv, dtype)
+        return kk, vv
+
+    def _fetch_to_device(self, cache_key, device):
+        kk, vv = self.cache[cache_key]
+        to_device = lambda t: t.to(device=device, non_blocking=True)
+        if _tensors(kk)[0].device != device:
+            if not (device.type == "cuda" and cache_key in self._prefetched):
+                self.stats["h2d_bytes"] += _nbytes(kk) + _nbytes(vv)
+        if device.type != "cuda" or not _tensors(kk)[0].is_pinned():
+            return _map(kk, to_device), _map(vv, to_device)
+
+        pending = self._prefetched.pop(cache_key, None)
+        if pending is not None:
+            kk, vv, event = pending
+            stream = torch.cuda.current_stream(device)
+            stream.wait_event(event)
+            # Tensors allocated on the side stream are now used on the compute stream
+            for t in _tensors(kk) + _tensors(vv):
+                t.record_stream(stream)
+        else:
+            kk, vv = _map(kk, to_device), _map(vv, to_device)
+
+        # Preallocated buffers fetch each block once, so a prefetch would never be consumed
+        if self.preallocate:
+            return kk, vv
+
+        # Blocks run in cache insertion order; queue the next one (wrapping to the next step)
+        if len(self._next_key) != len(self.cache):
+            keys = list(self.cache)
+            self._next_key = {key: keys[(i + 1) % len(keys)] for i, key in enumerate(keys)}
+        self._prefetch(self._next_key[cache_key], device)
+        return kk, vv
+
+    def _buffered(self, cache_key, k, v):
+        """Return K/V buffers holding [fresh tokens | cached reference tokens]."""
+        n_fresh = k.shape[2]
+        ref_shape = _tensors(self.cache[cache_key][0])[0].shape
+        shape = (k.shape[0], k.shape[1], n_fresh + ref_shape[2], k.shape[3])
+        # Keyed by shape too, so calls that alternate token counts (e.g. cond/uncond)
+        # each keep their own buffers instead of reallocating every time
+        buffer_key = (cache_key, shape, k.dtype, k.device)
+        buffers = self._buffers.get(buffer_key)
+        if buffers is None:
+            # Allocate and write the reference part once
+            kk, vv = self._fetch(cache_key, k.device, k.dtype)
+            buffers = (torch.empty(shape, dtype=k.dtype, device=k.device),
+                       torch.empty(shape, dtype=v.dtype, device=v.device))
+            # copy_ broadcasts deduplicated single-item entries over the batch
+            buffers[0][:, :, n_fresh:].copy_(kk)
+            buffers[1][:, :, n_fresh:].copy_(vv)
+            self._buffers[buffer_key] = buffers
+        kbuf, vbuf = buffers
+        with self._timed("concat_time_s", k.device):
+            kbuf[:, :, :n_fresh].copy_(k)
+            vbuf[:, :, :n_fresh].copy_(v)
+        return kbuf, vbuf
+
+    def resident_bytes(self):
+        """Bytes held by the cache per location (device name, or "disk" for spill files)."""
+        resident = {}
+        for cache_key, kv in self.cache.items():
+            for t in kv:
+                for x in _tensors(t):
+                    where = "disk" if self.tiers.get(cache_key) == "disk" else str(x.device)
+                    resident[where] = resident.get(where, 0) + x.nelement() * x.element_size()
+        for kv in self._buffers.values():
+            for x in kv:
+                where = f"{x.device} (buffers)"
+                resident[where] = resident.get(where, 0) + x.nelement() * x.element_size()
+        return resident
+
+    def stats_report(self):
+        self._collect_timings()
+        report = dict(self.stats)
+        report["blocks"] = len(self.cache)
+        report["resident_bytes"] = self.resident_bytes()
+        if self.compression_stats["numel"] > 0:
+            report["compression"] = self.compression_summary()
+        return report
+
+    @staticmethod
+    def _restore(t, dtype):
+        return t.dequantize(dtype) if isinstance(t, QuantizedKV) else t.to(dtype)
+
+    def compression_summary(self):
+        stats = self.compression_stats
+        if stats["numel"] == 0:
+            return ""
+        saved = stats["raw_bytes"] - stats["stored_bytes"]
+        rmse = (stats["sq_err"] / stats["numel"]) ** 0.5
+        return (f"{self.compression}: {stats['raw_bytes'] / (1024 * 1024):.0f} MB -> {stats['stored_bytes'] / (1024 * 1024):.0f} MB "
+                f"(saved {saved / (1024 * 1024):.0f} MB), max abs err {stats['max_abs_err']:.4g}, rmse {rmse:.4g}")
+
+    def tier_summary(self):
+        return ", ".join(f"{tier}: {nbytes / (1024 * 1024):.0f} MB" for tier, nbytes in self._tier_bytes.items() if nbytes > 0)
+
+    def lookup_persistent(self, ref_tokens, reference_image_num_tokens):
+        """
+        Called from the post-input patch with the projected reference tokens.
+        On a hit the cache is filled from the store before any block runs;
+        on a miss the key is remembered and the cache is stored once built.
+        """
+        if len(self.cache) > 0:
+            if self._pending_key is not None:
+                _store_persistent(self._pending_key, self.cache, self.persistent_budget)
+                self._pending_key = None
+            return
+
+        ref_hash = (sum(reference_image_num_tokens), tuple(reference_image_num_tokens))
+        # Entries hold K/V as stored (possibly quantized), so the compression mode is part of the key
+        key = (self.model_key, ref_hash, _tensor_digest(ref_tokens), self.compression)
+        if key in _PERSISTENT_KV:
+            _PERSISTENT_KV.move_to_end(key)
+            entry, _ = _PERSISTENT_KV[key]
+            self._reset()
+            self.cache = {name: self._store(name, kk, vv, ref_tokens.device) for name, (kk, vv) in entry.items()}
+            self._ref_hash = ref_hash
+            self._logged_build = True
+            self.stats["persistent_hits"] += 1
+            logging.info("Flux KV Cache (GGUF): Cache reused from a previous prompt")
+        else:
+            self._pending_key = key
 
     def __call__(self, q, k, v, extra_options, **kwargs):
         reference_image_num_tokens = extra_options.get("reference_image_num_tokens", [])
@@ -33,28 +449,40 @@ class GGUF_KV_Attn_Input:
         # If reference images changed (added/removed), invalidate cache
         if ref_hash != self._ref_hash:
             is_rebuild = len(self.cache) > 0
-            self.cache = {}
+            self._reset()
             self._ref_hash = ref_hash
             self._logged_build = False
             if is_rebuild:
+                self.stats["rebuilds"] += 1
                 logging.info("Flux KV Cache (GGUF): Cache rebuilt")
 
         cache_key = "{}_{}".format(extra_options["block_type"], extra_options["block_index"])
 
         if cache_key in self.cache:
-            kk, vv = self.cache[cache_key]
-            # Move cached tensors from CPU to the compute device
-            kk = kk.to(device=k.device, dtype=k.dtype)
-            vv = vv.to(device=v.device, dtype=v.dtype)
             self.set_cache = False
-            return {"q": q, "k": torch.cat((k, kk), dim=2), "v": torch.cat((v, vv), dim=2)}
+            self.stats["hits"] += 1
+            if not self._logged_summary:
+                if self.tiered:
+                    logging.info(f"Flux KV Cache (GGUF): Tier placement ({self.tier_summary()})")
+                if self.compression_stats["numel"] > 0:
+                    logging.info(f"Flux KV Cache (GGUF): Compression {self.compression_summary()}")
+                self._logged_summary = True
+            if self.preallocate:
+                k_full, v_full = self._buffered(cache_key, k, v)
+                return {"q": q, "k": k_full, "v": v_full}
+            # Move cached tensors from CPU to the compute device
+            kk, vv = self._fetch(cache_key, k.device, k.dtype)
+            if kk.shape[0] != k.shape[0]:
+                # Deduplicated entry: broadcast view over the batch
+                kk, vv = kk.expand(k.shape[0], -1, -1, -1), vv.expand(v.shape[0], -1, -1, -1)
+            with self._timed("concat_time_s", k.device):
+                k_full, v_full = torch.cat((k, kk), dim=2), torch.cat((v, vv), dim=2)
+            return {"q": q, "k": k_full, "v": v_full}
 
         # First pass (step 0): cache reference K/V on the chosen device (CPU by default)
-        self.cache[cache_key] = (
-            k[:, :, -ref_toks:].detach().to(self.cache_device),
-            v[:, :, -ref_toks:].detach().to(self.cache_device),
-        )
+        self.cache[cache_key] = self._store(cache_key, k[:, :, -ref_toks:].detach(), v[:, :, -ref_toks:].detach(), k.device)
         self.set_cache = True
+        self.stats["misses"] += 1
         if not self._logged_build:
             logging.info("Flux KV Cache (GGUF): Cache built")
             self._logged_build = True
@@ -87,6 +515,12 @@ class FluxKVCacheGGUF:
             },
             "optional": {
                 "cache_on_cpu": ("BOOLEAN", {"default": True, "tooltip": "Store KV cache on CPU (survives VRAM pressure) or GPU (faster but may be lost during offloading)"}),
+                "persistent_cache_mb": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 256, "tooltip": "CPU budget for reusing reference K/V across prompts with identical reference images and model (0 disables). The reused K/V come from the first prompt's step 0, so results can differ slightly from a fresh build."}),
+                "tiered_cache": ("BOOLEAN", {"default": False, "tooltip": "Place each block's K/V on the GPU (up to vram_budget_mb), then in CPU RAM, then optionally on disk, based on the free memory reported at build time. Overrides cache_on_cpu."}),
+                "vram_budget_mb": ("INT", {"default": 2048, "min": 0, "max": 65536, "step": 256, "tooltip": "Tiered cache: VRAM reserved for the hottest K/V blocks."}),
+                "disk_spill": ("BOOLEAN", {"default": False, "tooltip": "Tiered cache: spill blocks to memory-mapped files in the temp directory when host RAM runs low."}),
+                "compression": (["none", "int8", "fp8"], {"default": "none", "tooltip": "Store cached K/V as per-head scaled int8 or fp8 and dequantize on use. Roughly halves cache memory and transfers at a small accuracy cost (logged once the cache is built)."}),
+                "preallocate_buffers": ("BOOLEAN", {"default": False, "tooltip": "Keep one full-sequence K/V buffer per block on the GPU with the reference part written once, so each step copies only the new tokens instead of concatenating. Faster, but holds extra VRAM outside ComfyUI's model management."}),
             }
         }
 
@@ -105,14 +539,22 @@ class FluxKVCacheGGUF:
         return float("nan")
 
     @classmethod
-    def execute(cls, model, cache_on_cpu=True):
+    def execute(cls, model, cache_on_cpu=True, persistent_cache_mb=0, tiered_cache=False, vram_budget_mb=2048, disk_spill=False, compression="none", preallocate_buffers=False):
         m = model.clone()
         cache_device = "cpu" if cache_on_cpu else "cuda"
-        input_patch_obj = GGUF_KV_Attn_Input(cache_device=cache_device)
+        model_key = (id(model.model), getattr(model, "patches_uuid", None))
+        input_patch_obj = GGUF_KV_Attn_Input(cache_device=cache_device, model_key=model_key,
+                                             persistent_budget=persistent_cache_mb * 1024 * 1024,
+                                             tiered=tiered_cache, vram_budget=vram_budget_mb * 1024 * 1024,
+                                             disk_spill=disk_spill, compression=compression,
+                                             preallocate=preallocate_buffers)
 
         def model_input_patch(inputs):
+            reference_image_num_tokens = inputs["transformer_options"].get("reference_image_num_tokens", [])
+            ref_image_tokens = sum(reference_image_num_tokens)
+            if persistent_cache_mb > 0 and ref_image_tokens > 0:
+                input_patch_obj.lookup_persistent(inputs["img"][:, -ref_image_tokens:], reference_image_num_tokens)
             if len(input_patch_obj.cache) > 0:
-                ref_image_tokens = sum(inputs["transformer_options"].get("reference_image_num_tokens", []))
                 if ref_image_tokens > 0:
                     img = inputs["img"]
                     inputs["img"] = img[:, :-ref_image_tokens]
@@ -125,15 +567,81 @@ class FluxKVCacheGGUF:
         else:
             m.add_object_patch("diffusion_model.default_ref_method", "index_timestep_zero")
 
-        cache_label = "CPU" if cache_on_cpu else "GPU"
+        cache_label = "tiered" if tiered_cache else ("CPU" if cache_on_cpu else "GPU")
         logging.info(f"Flux KV Cache (GGUF): Applied on {cache_label}")
         return (m,)
 
 
+def _format_bytes(nbytes):
+    return f"{nbytes / (1024 * 1024):.1f} MB"
+
+
+class FluxKVCacheStats:
+    """
+    Shows the counters of the most recent Flux KV Cache (GGUF) run.
+
+    Connect the sampler's LATENT through this node so it runs after sampling;
+    the latent is passed through unchanged.
+    """
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "latent": ("LATENT", {"tooltip": "Sampler output, passed through unchanged. Only used to run this node after sampling."}),
+            },
+            "optional": {
+                "dump_json": ("BOOLEAN", {"default": False, "tooltip": "Also write the statistics as JSON to the output directory."}),
+                "filename_prefix": ("STRING", {"default": "flux_kv_cache_stats"}),
+            }
+        }
+
+    RETURN_TYPES = ("LATENT", "STRING")
+    RETURN_NAMES = ("latent", "stats")
+    FUNCTION = "execute"
+    OUTPUT_NODE = True
+    CATEGORY = "bootleg"
+    DESCRIPTION = "Displays hit/miss counts, resident memory, host-to-device traffic and transfer/concat time of the last Flux KV Cache (GGUF) run."
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        return float("nan")
+
+    def execute(self, latent, dump_json=False, filename_prefix="flux_kv_cache_stats"):
+        cache = _LAST_CACHE() if _LAST_CACHE is not None else None
+        if cache is None:
+            text = "No Flux KV Cache (GGUF) run found."
+            return {"ui": {"text": (text,)}, "result": (latent, text)}
+
+        report = cache.stats_report()
+        lines = [
+            f"Blocks cached: {report['blocks']}",
+            f"Hits: {report['hits']}  Misses: {report['misses']}  Rebuilds: {report['rebuilds']}  Reused across prompts: {report['persistent_hits']}",
+            f"Blocks stored once for the whole batch: {report['deduped_blocks']}",
+            f"Host-to-device: {_format_bytes(report['h2d_bytes'])}",
+            f"Transfer time: {report['transfer_time_s']:.3f} s  Concat time: {report['concat_time_s']:.3f} s ",
+        ]
+        for where, nbytes in report["resident_bytes"].items():
+            lines.append(f"Resident on {where}: {_format_bytes(nbytes)}")
+        if "compression" in report:
+            lines.append(f"Compression: {report['compression']}")
+        text = "\n".join(lines)
+
+        if dump_json:
+            output_dir = folder_paths.get_output_directory()
+            path = os.path.join(output_dir, f"{filename_prefix}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            text += f"\nSaved: {os.path.basename(path)}"
+
+        return {"ui": {"text": (text,)}, "result": (latent, text)}
+
+
 NODE_CLASS_MAPPINGS = {
     "FluxKVCacheGGUF": FluxKVCacheGGUF,
+    "FluxKVCacheStats": FluxKVCacheStats,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "FluxKVCacheGGUF": "🚀 Flux KV Cache (GGUF)",
+    "FluxKVCacheStats": "🚀 Flux KV Cache Stats",
 }
@@ -1,7 +1,8 @@
-import torch
-import torch.nn.functional as F
 import node_helpers
 
+from yarvixpa_shared.inpaint_encode import DEFAULT_TILE_SIZE, ENCODE_MODES, crop_region, inpaint_encode
+from yarvixpa_shared.latent_cache import DEFAULT_CACHE_MB
+
 
 def conditioning_set_values(cond, vals={}):
     result = []
@@ -31,48 +32,87 @@ class InpaintFluxKontextConditioning:
                         "tooltip": "Add a noise mask to the latent so sampling will only happen within the mask.",
                     },
                 ),
-            }
+            },
+            "optional": {
+                "crop_to_mask": (
+                    "BOOLEAN",
+                    {
+                        "default": False,
+                        "tooltip": "Encode and sample only the bounding box of the mask plus context padding. Use Inpaint Uncrop to paste the decoded result back into the full image.",
+                    },
+                ),
+                "context_padding": (
+                    "INT",
+                    {
+                        "default": 64,
+                        "min": 0,
+                        "max": 4096,
+                        "step": 8,
+                        "tooltip": "Pixels of context kept around the mask when crop_to_mask is on. The region is snapped to the 8 px latent grid.",
+                    },
+                ),
+                "cache_mb": (
+                    "INT",
+                    {
+                        "default": DEFAULT_CACHE_MB,
+                        "min": 0,
+                        "max": 65536,
+                        "step": 64,
+                        "tooltip": "RAM budget of the shared latent cache, so re-running with the same image, mask and VAE skips the encode. 0 disables it.",
+                    },
+                ),
+                "encode_mode": (
+                    ENCODE_MODES,
+                    {
+                        "default": "auto",
+                        "tooltip": "auto: ComfyUI's VAE encode, which retries tiled by itself when it runs out of memory (smaller tiles are tried if that fails too). tiled: always encode in tiles, starting at tile_size.",
+                    },
+                ),
+                "tile_size": (
+                    "INT",
+                    {
+                        "default": DEFAULT_TILE_SIZE,
+                        "min": 128,
+                        "max": 4096,
+                        "step": 64,
+                        "tooltip": "Starting tile size for tiled encoding; halved automatically while it still runs out of memory.",
+                    },
+                ),
+            },
         }
 
-    RETURN_TYPES = ("CONDITIONING", "CONDITIONING", "LATENT")
-    RETURN_NAMES = ("positive", "negative", "latent")
+    RETURN_TYPES = ("CONDITIONING", "CONDITIONING", "LATENT", "INPAINT_CROP")
+    RETURN_NAMES = ("positive", "negative", "latent", "crop")
     FUNCTION = "encode"
     CATEGORY = "ComfyUI-YarvixPA/Flux/Kontext"
     DESCRIPTION = "Adds context-aware inpainting conditioning for Flux pipelines."
 
-    def _encode_latent(self, vae, pixels):
-        encoded = vae.encode(pixels[:, :, :, :3])
-        return {"samples": encoded}
-
-    def encode(self, positive, negative, pixels, vae, mask, noise_mask):
-        # ajustar dimensiones a múltiplos de 8
-        new_h, new_w = (pixels.shape[1] // 8) * 8, (pixels.shape[2] // 8) * 8
-        mask = F.interpolate(
-            mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])),
-            size=(pixels.shape[1], pixels.shape[2]),
-            mode="bilinear",
+    def encode(
+        self,
+        positive,
+        negative,
+        pixels,
+        vae,
+        mask,
+        noise_mask,
+        crop_to_mask=False,
+        context_padding=64,
+        cache_mb=DEFAULT_CACHE_MB,
+        encode_mode="auto",
+        tile_size=DEFAULT_TILE_SIZE,
+    ):
+        # recorte a la región de la máscara (o a múltiplos de 8 de la imagen completa)
+        pixels, mask, crop = crop_region(pixels, mask, context_padding if crop_to_mask else None)
+
+        # máscara y una sola llamada al VAE para ambas imágenes
+        concat_latent, orig_latent, mask = inpaint_encode(
+            vae, pixels, mask, cache_mb, encode_mode, tile_size, box=crop["box"]
         )
 
-        original, working = pixels, pixels.clone()
-        if working.shape[1] != new_h or working.shape[2] != new_w:
-            h_off, w_off = (working.shape[1] % 8) // 2, (working.shape[2] % 8) // 2
-            working = working[:, h_off : new_h + h_off, w_off : new_w + w_off, :]
-            mask = mask[:, :, h_off : new_h + h_off, w_off : new_w + w_off]
-
-        # aplicar máscara sobre píxeles
-        blend = (1.0 - mask.round()).squeeze(1)
-        working[:, :, :, :3] = (working[:, :, :, :3] - 0.5) * blend.unsqueeze(-1) + 0.5
-
-        concat_latent = vae.encode(working)
-        orig_latent = vae.encode(original)
-
         latent_dict = {"samples": orig_latent}
         if noise_mask:
             latent_dict["noise_mask"] = mask
 
-        # codificación auxiliar de referencia
-        reference_latent = self._encode_latent(vae, original)
-
         conditioned = []
         for current in [positive, negative]:
             base = conditioning_set_values(
@@ -80,12 +120,12 @@ class InpaintFluxKontextConditioning:
             )
             extended = node_helpers.conditioning_set_values(
                 base,
-                {"reference_latents": [reference_latent["samples"]]},
+                {"reference_latents": [orig_latent]},
                 append=True,
             )
             conditioned.append(extended)
 
-        return (conditioned[0], conditioned[1], latent_dict)
+        return (conditioned[0], conditioned[1], latent_dict, crop)
 
 
 NODE_CLASS_MAPPINGS = {
@@ -2,12 +2,16 @@ import os
 import sys
 import math
 import importlib
+import uuid
+import weakref
+from collections import OrderedDict
 import torch
 import torch.nn.functional as F
 from safetensors.torch import load_file as safetensors_load_file
-from torchvision import transforms
-from PIL import Image
-import numpy as np
+from comfy import model_management
+import comfy.model_patcher
+import comfy.utils
+import folder_paths
 
 # Optimizar precisión para multiplicaciones matriciales
 torch.set_float32_matmul_precision('high')
@@ -26,7 +30,7 @@ def select_device(device):
         return 'cuda' if torch.cuda.is_available() else 'cpu'
     return device
 
-# Inicializar modelo vendorizado en ComfyUI/models, sin cache global
+# Inicializar modelo vendorizado en ComfyUI/models (la cache vive en get_model)
 def initialize_model(repo_id, model_name, update_model=False):
     base = os.path.join('ComfyUI', 'models', 'ComfyUI-YarvixPA', 'RemoveBackground')
     target_dir = os.path.join(base, model_name)
@@ -56,21 +60,218 @@ def initialize_model(repo_id, model_name, update_model=False):
     model.load_state_dict(state)
     return model
 
-# Conversiones
+# Cache de modelos residente (LRU) compartida por todo el proceso.
+# Clave: (nombre del modelo, dispositivo, dtype) -> ModelPatcher
+_MODEL_CACHE = OrderedDict()
+DEFAULT_CACHE_BUDGET_MB = 4096
 
-def to_pil(tensor):
-    arr = (tensor.squeeze().cpu().numpy() * 255).astype(np.uint8)
-    return Image.fromarray(arr)
+def _evict_models(budget_bytes):
+    # Descarta los modelos menos usados hasta respetar el presupuesto (siempre conserva el último)
+    total = sum(p.model_size() for p in _MODEL_CACHE.values())
+    while total > budget_bytes and len(_MODEL_CACHE) > 1:
+        key, patcher = _MODEL_CACHE.popitem(last=False)
+        total -= patcher.model_size()
+        print(f"🦝 Remove Background: {key[0]} ({key[1]}, {key[2]}) descartado de la cache.")
 
-# Para imagen (RGB/RGBA) y máscara (L) en formato CHANNEL-LAST
+def clear_model_cache(model_name=None):
+    for key in [k for k in _MODEL_CACHE if model_name is None or k[0] == model_name]:
+        del _MODEL_CACHE[key]
 
-def pil_to_tensor(pil):
-    arr = np.array(pil).astype(np.float32) / 255.0
-    if pil.mode == 'L':  # máscara de un canal
-        tensor = torch.from_numpy(arr).unsqueeze(0)           # [1, H, W]
-    else:  # RGB/RGBA
-        tensor = torch.from_numpy(arr).unsqueeze(0)           # [1, H, W, C]
-    return tensor
+def get_model(repo_id, model_name, dev, update_model=False, budget_mb=DEFAULT_CACHE_BUDGET_MB):
+    """Devuelve un ModelPatcher con BiRefNet listo en `dev`, reutilizando la cache si es posible."""
+    dtype = torch.float16 if dev == 'cuda' else torch.float32
+    key = (model_name, dev, dtype)
+    if update_model:
+        clear_model_cache(model_name)
+
+    patcher = _MODEL_CACHE.get(key)
+    if patcher is None:
+        net = initialize_model(repo_id, model_name, update_model).eval().to(dtype)
+        load_device = model_management.get_torch_device() if dev == 'cuda' else torch.device('cpu')
+        patcher = comfy.model_patcher.ModelPatcher(net, load_device=load_device, offload_device=torch.device('cpu'))
+        if budget_mb > 0:
+            _MODEL_CACHE[key] = patcher
+            _evict_models(budget_mb * 1024 * 1024)
+    else:
+        _MODEL_CACHE.move_to_end(key)
+
+    # ComfyUI gestiona la VRAM: puede descargar el modelo cuando otro lo necesite
+    if dev == 'cuda':
+        model_management.load_models_gpu([patcher], force_full_load=True)
+    return patcher
+
+# Preprocesado e inferencia por lotes
+NORM_MEAN = (0.485, 0.456, 0.406)
+NORM_STD = (0.229, 0.224, 0.225)
+DEFAULT_BATCH_SIZE = 4
+BACKGROUND_VALUES = {'white': 1.0, 'black': 0.0}
+DEFAULT_TILE_OVERLAP = 64
+MIN_TILE_SIZE = 256
+
+def normalize(x):
+    """Normalización fusionada: (x - mean) / std == x * (1/std) + (-mean/std)."""
+    inv_std = torch.tensor([1/sd for sd in NORM_STD], device=x.device, dtype=x.dtype).view(1, 3, 1, 1)
+    shift = torch.tensor([-mu/sd for mu, sd in zip(NORM_MEAN, NORM_STD)], device=x.device, dtype=x.dtype).view(1, 3, 1, 1)
+    return torch.addcmul(shift, x, inv_std)
+
+def preprocess_batch(frames, cfg, device, dtype):
+    """[b,H,W,C] -> entrada normalizada y con padding [b,3,Hp,Wp], más el tamaño útil (nh, nw)."""
+    x = frames[..., :3].movedim(-1, 1).to(device)
+    oh, ow = x.shape[-2:]
+    if not cfg['dynamic']:
+        tw, th = cfg['size']
+        scale = min(tw/ow, th/oh)
+        nw, nh = int(ow*scale), int(oh*scale)
+        x = F.interpolate(x, size=(nh, nw), mode='bilinear', align_corners=False, antialias=True)
+        pad_w, pad_h = tw - nw, th - nh
+    else:
+        nw, nh = ow, oh
+        pad_w = math.ceil(ow/32)*32 - ow
+        pad_h = math.ceil(oh/32)*32 - oh
+    x = F.pad(normalize(x), (0, pad_w, 0, pad_h), value=0)
+    return x.to(dtype), nh, nw
+
+def forward_tiled(net, x, dtype, tile_size, overlap):
+    """
+    Inferencia por teselas para BiRefNet_dynamic. Los logits de la máscara se mezclan con
+    el difuminado de comfy.utils.tiled_scale; ante OOM la tesela se reduce a la mitad.
+    """
+    def fn(tile):
+        th, tw = tile.shape[-2:]
+        tile = F.pad(tile, (0, math.ceil(tw/32)*32 - tw, 0, math.ceil(th/32)*32 - th), value=0)
+        return net(tile.to(dtype))[-1][:, :, :th, :tw].float()
+
+    while True:
+        try:
+            return comfy.utils.tiled_scale(x, fn, tile_x=tile_size, tile_y=tile_size, overlap=min(overlap, tile_size // 4),
+                                           upscale_amount=1, out_channels=1, output_device=x.device)
+        except model_management.OOM_EXCEPTION as e:
+            tile_size //= 2
+            if tile_size < MIN_TILE_SIZE:
+                raise e
+            model_management.soft_empty_cache()
+
+def forward_batch(net, frames, cfg, device, dtype, tile_size=0, tile_overlap=DEFAULT_TILE_OVERLAP):
+    """Ejecuta BiRefNet sobre un lote y devuelve las máscaras [b,1,H,W] a resolución original."""
+    oh, ow = frames.shape[1], frames.shape[2]
+    with torch.no_grad():
+        if cfg['dynamic'] and tile_size > 0 and max(oh, ow) > tile_size:
+            x = normalize(frames[..., :3].movedim(-1, 1).to(device))
+            out = forward_tiled(net, x, dtype, tile_size, tile_overlap)
+            nh, nw = oh, ow
+        else:
+            inp, nh, nw = preprocess_batch(frames, cfg, device, dtype)
+            out = net(inp)[-1].float()
+    out = out.sigmoid()
+    # Normalización min-max por imagen
+    mn = out.amin(dim=(1, 2, 3), keepdim=True)
+    mx = out.amax(dim=(1, 2, 3), keepdim=True)
+    out = (out - mn) / (mx - mn)
+    m = out[:, :, :nh, :nw]
+    if not cfg['dynamic']:
+        m = F.interpolate(m, size=(oh, ow), mode='bilinear', align_corners=False)
+    return m
+
+def composite(frames, masks, background_color):
+    """Compone [b,H,W,C] con máscaras [b,1,H,W] igual que Image.paste con máscara sobre el fondo."""
+    rgb = frames[..., :3]
+    m = masks.movedim(1, -1).to(rgb.dtype)
+    if background_color == 'transparency':
+        # Fondo RGBA (0,0,0,0): color premultiplicado y alfa = máscara
+        img = torch.cat((rgb * m, m), dim=-1)
+    else:
+        img = torch.lerp(torch.full_like(rgb, BACKGROUND_VALUES[background_color]), rgb, m)
+    return img, masks.squeeze(1)
+
+def remove_background_batch(net, frames, cfg, device, dtype, background_color, tile_size=0, tile_overlap=DEFAULT_TILE_OVERLAP):
+    """Lote completo en el dispositivo: inferencia + composición, sin pasar por PIL."""
+    frames = frames.to(device)
+    masks = forward_batch(net, frames, cfg, device, dtype, tile_size, tile_overlap)
+    return composite(frames.float(), masks, background_color)
+
+def iter_chunks(total, batch_size, fn):
+    """Llama a fn(inicio, fin) en bloques de `batch_size` elementos y produce (inicio, resultado); ante OOM reduce el bloque a la mitad."""
+    pbar = comfy.utils.ProgressBar(total)
+    i = 0
+    while i < total:
+        end = min(i + batch_size, total)
+        try:
+            out = fn(i, end)
+        except model_management.OOM_EXCEPTION as e:
+            if batch_size == 1:
+                raise e
+            batch_size //= 2
+            model_management.soft_empty_cache()
+            continue
+        yield i, out
+        pbar.update(end - i)
+        i = end
+
+# Modo temporal: inferencia solo en fotogramas clave
+THUMB_SIZE = 64
+
+def frame_thumbnails(image, device, batch_size=64):
+    """Miniaturas en escala de grises [B,64,64] en CPU para medir diferencias entre fotogramas."""
+    thumbs = []
+    for i in range(0, image.shape[0], batch_size):
+        gray = image[i:i + batch_size, ..., :3].to(device).float().mean(dim=-1, keepdim=True).movedim(-1, 1)
+        thumbs.append(F.adaptive_avg_pool2d(gray, THUMB_SIZE).squeeze(1).cpu())
+    return torch.cat(thumbs, dim=0)
+
+def select_keyframes(thumbs, keyframe_threshold, scene_cut_threshold, max_interval):
+    """
+    Devuelve (keyframes, cortes). Un fotograma es clave si se aleja del último clave más de
+    `keyframe_threshold`, si pasan `max_interval` fotogramas, o si es un corte de escena
+    (diferencia con el anterior mayor que `scene_cut_threshold`).
+    """
+    keyframes, cuts = [0], set()
+    last = 0
+    for i in range(1, thumbs.shape[0]):
+        if (thumbs[i] - thumbs[i - 1]).abs().mean().item() > scene_cut_threshold:
+            cuts.add(i)
+        elif (thumbs[i] - thumbs[last]).abs().mean().item() <= keyframe_threshold and i - last < max_interval:
+            continue
+        keyframes.append(i)
+        last = i
+    return keyframes, cuts
+
+def interpolation_plan(num_frames, keyframes, cuts):
+    """Para cada fotograma: índice del clave anterior, del siguiente y peso de interpolación."""
+    prev_idx, next_idx, weights = [], [], []
+    k = 0
+    for i in range(num_frames):
+        while k + 1 < len(keyframes) and keyframes[k + 1] <= i:
+            k += 1
+        k0 = keyframes[k]
+        # Sin clave posterior o con un corte de escena en medio: se mantiene la máscara anterior
+        if i == k0 or k + 1 == len(keyframes) or keyframes[k + 1] in cuts:
+            prev_idx.append(k); next_idx.append(k); weights.append(0.0)
+        else:
+            k1 = keyframes[k + 1]
+            prev_idx.append(k); next_idx.append(k + 1); weights.append((i - k0) / (k1 - k0))
+    return torch.tensor(prev_idx), torch.tensor(next_idx), torch.tensor(weights)
+
+def allocate_output(shape, output_buffer):
+    """Buffer de salida float32 preasignado, en RAM o mapeado a un fichero del directorio temporal."""
+    if output_buffer == 'disk':
+        temp_dir = folder_paths.get_temp_directory()
+        os.makedirs(temp_dir, exist_ok=True)
+        path = os.path.join(temp_dir, f"remove_background_{uuid.uuid4().hex}.bin")
+        buffer = torch.from_file(path, shared=True, size=math.prod(shape), dtype=torch.float32).view(shape)
+        # El mapeo sigue siendo válido tras borrar el fichero (POSIX); si el sistema no lo
+        # permite (Windows), se borra cuando el tensor se libera
+        try:
+            os.remove(path)
+        except OSError:
+            weakref.finalize(buffer, _remove_quietly, path)
+        return buffer
+    return torch.empty(shape, dtype=torch.float32)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 class RemoveBackgroundNode:
     @classmethod
@@ -81,6 +282,26 @@ class RemoveBackgroundNode:
             'background_color':(['transparency','white','black'],{'default':'transparency'}),
             'device':(['auto','cuda','cpu'],{'default':'auto'}),
             'update_model':('BOOLEAN',{'default':False})
+        },
+        'optional':{
+            'cache_budget_mb':('INT',{'default':DEFAULT_CACHE_BUDGET_MB,'min':0,'max':65536,'step':256,
+                                      'tooltip':'Memory budget for loaded BiRefNet models kept between runs (least recently used are dropped first). 0 disables the cache.'}),
+            'batch_size':('INT',{'default':DEFAULT_BATCH_SIZE,'min':1,'max':256,
+                                 'tooltip':'Frames sent to BiRefNet per forward pass. Halved automatically on out-of-memory errors.'}),
+            'output_buffer':(['memory','disk'],{'default':'memory',
+                                                'tooltip':'Where the results are written while streaming. "disk" memory-maps them to a file in the temp directory to keep RAM usage flat on long videos.'}),
+            'temporal_mode':('BOOLEAN',{'default':False,
+                                        'tooltip':'Video only: run BiRefNet on keyframes and interpolate the masks of the frames in between.'}),
+            'keyframe_threshold':('FLOAT',{'default':0.02,'min':0.0,'max':1.0,'step':0.001,
+                                           'tooltip':'Mean absolute difference from the last keyframe that triggers a new keyframe.'}),
+            'scene_cut_threshold':('FLOAT',{'default':0.15,'min':0.0,'max':1.0,'step':0.001,
+                                            'tooltip':'Difference from the previous frame treated as a scene change: forces a keyframe and disables interpolation across it.'}),
+            'max_keyframe_interval':('INT',{'default':8,'min':1,'max':1000,
+                                            'tooltip':'Maximum number of frames between keyframes.'}),
+            'tile_size':('INT',{'default':0,'min':0,'max':8192,'step':32,
+                                'tooltip':'BiRefNet_dynamic only: split images larger than this into tiles (0 disables tiling). Halved automatically on out-of-memory errors.'}),
+            'tile_overlap':('INT',{'default':DEFAULT_TILE_OVERLAP,'min':0,'max':1024,'step':8,
+                                   'tooltip':'Overlap between tiles; mask logits are feather-blended across it.'}),
         }}
     RETURN_TYPES = ('IMAGE','MASK')
     RETURN_NAMES = ('image','mask')
@@ -88,63 +309,57 @@ class RemoveBackgroundNode:
     CATEGORY = 'ComfyUI-YarvixPA/Image/RemoveBackground'
     DESCRIPTION = "Removes the background from an image using various BiRefNet models."
 
-    def background_remove(self, image, model, background_color, device, update_model):
+    def background_remove(self, image, model, background_color, device, update_model,
+                          cache_budget_mb=DEFAULT_CACHE_BUDGET_MB, batch_size=DEFAULT_BATCH_SIZE, output_buffer='memory',
+                          temporal_mode=False, keyframe_threshold=0.02, scene_cut_threshold=0.15, max_keyframe_interval=8,
+                          tile_size=0, tile_overlap=DEFAULT_TILE_OVERLAP):
         cfg = MODEL_CONFIGS[model]
         dev = select_device(device)
-        net = initialize_model(cfg['repo_id'], model, update_model).to(dev)
-        net.eval()
-        if dev == 'cuda': net.half()
-
-        results_img, results_mask = [], []
-        # Transform básico
-        transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
-        ])
-        for t in image:
-            pil = to_pil(t)
-            ow, oh = pil.size
-            # Preprocesado y padding
-            if not cfg['dynamic']:
-                tw, th = cfg['size']
-                scale = min(tw/ow, th/oh)
-                nw, nh = int(ow*scale), int(oh*scale)
-                resized = pil.resize((nw, nh), Image.BILINEAR)
-                inp = transform(resized).unsqueeze(0).to(dev)
-                pad_w = tw - nw
-                pad_h = th - nh
-                inp = F.pad(inp, (0, pad_w, 0, pad_h), value=0)
-            else:
-                inp = transform(pil).unsqueeze(0).to(dev)
-                pad_w = math.ceil(ow/32)*32 - ow
-                pad_h = math.ceil(oh/32)*32 - oh
-                inp = F.pad(inp, (0, pad_w, 0, pad_h), value=0)
-            if dev=='cuda': inp = inp.half()
-
-            # Inferencia
-            with torch.no_grad():
-                out = net(inp)[-1].sigmoid().cpu()
-                out = (out - out.min())/(out.max()-out.min())
-            # Postprocesado máscara
-            if not cfg['dynamic']:
-                m = out[:, :, :nh, :nw]
-                m = F.interpolate(m, size=(oh,ow), mode='bilinear', align_corners=False)
-            else:
-                m = out[:, :, :oh, :ow]
-            mask_pil = to_pil(m)
-
-            # Composición
-            mode_fg = 'RGBA' if background_color=='transparency' else 'RGB'
-            col = (0,0,0,0) if background_color=='transparency' else background_color
-            bg = Image.new(mode_fg, (ow,oh), col)
-            bg.paste(pil, mask=mask_pil)
-
-            # Agregar tensores channel-last
-            results_img.append(pil_to_tensor(bg))
-            results_mask.append(pil_to_tensor(mask_pil))
-
-        # Concatenar en batch axis
-        return torch.cat(results_img, dim=0), torch.cat(results_mask, dim=0)
+        patcher = get_model(cfg['repo_id'], model, dev, update_model, cache_budget_mb)
+        dtype = torch.float16 if dev == 'cuda' else torch.float32
+
+        # Salida preasignada: cada bloque se escribe en su sitio en lugar de concatenar al final
+        b, h, w = image.shape[0], image.shape[1], image.shape[2]
+        channels = 4 if background_color == 'transparency' else 3
+        out_img = allocate_output((b, h, w, channels), output_buffer)
+        out_mask = allocate_output((b, h, w), output_buffer)
+
+        net, net_device = patcher.model, patcher.load_device
+        tiling = (tile_size, tile_overlap)
+        if temporal_mode and b > 1:
+            self._temporal(net, image, cfg, net_device, dtype, background_color, batch_size, output_buffer,
+                           keyframe_threshold, scene_cut_threshold, max_keyframe_interval, tiling, out_img, out_mask)
+        else:
+            fn = lambda i, j: remove_background_batch(net, image[i:j], cfg, net_device, dtype, background_color, *tiling)
+            for start, (img, mask) in iter_chunks(b, batch_size, fn):
+                out_img[start:start + img.shape[0]].copy_(img)
+                out_mask[start:start + mask.shape[0]].copy_(mask)
+
+        return out_img, out_mask
+
+    def _temporal(self, net, image, cfg, device, dtype, background_color, batch_size, output_buffer,
+                  keyframe_threshold, scene_cut_threshold, max_interval, tiling, out_img, out_mask):
+        b, h, w = image.shape[0], image.shape[1], image.shape[2]
+        thumbs = frame_thumbnails(image, device)
+        keyframes, cuts = select_keyframes(thumbs, keyframe_threshold, scene_cut_threshold, max_interval)
+        print(f"🦝 Remove Background: modo temporal, {len(keyframes)} fotogramas clave de {b}.")
+
+        # Inferencia solo sobre los fotogramas clave
+        key_masks = allocate_output((len(keyframes), 1, h, w), output_buffer)
+        fn = lambda i, j: forward_batch(net, image[keyframes[i:j]], cfg, device, dtype, *tiling)
+        for start, masks in iter_chunks(len(keyframes), batch_size, fn):
+            key_masks[start:start + masks.shape[0]].copy_(masks)
+
+        # Interpolación de máscaras y composición por ventanas
+        prev_idx, next_idx, weights = interpolation_plan(b, keyframes, cuts)
+        for i in range(0, b, batch_size):
+            j = min(i + batch_size, b)
+            m0 = key_masks[prev_idx[i:j]].to(device)
+            m1 = key_masks[next_idx[i:j]].to(device)
+            masks = torch.lerp(m0, m1, weights[i:j].to(device).view(-1, 1, 1, 1))
+            img, mask = composite(image[i:j].to(device).float(), masks, background_color)
+            out_img[i:j].copy_(img)
+            out_mask[i:j].copy_(mask)
 
 NODE_CLASS_MAPPINGS = {
     "RemoveBackgroundNode": RemoveBackgroundNode
@@ -1,9 +1,13 @@
 import os
+import json
+import math
 import logging
+from collections import OrderedDict
 from spandrel import ModelLoader, ImageModelDescriptor
 from comfy import model_management
 import torch
 import comfy.utils
+import comfy.model_patcher
 import folder_paths
 
 try:
@@ -14,6 +18,226 @@ try:
 except:
     pass
 
+# Loaded upscale models kept between runs, keyed by (path, mtime, dtype).
+# Each entry holds the spandrel descriptor and the ModelPatcher registered with model_management.
+_MODEL_CACHE = OrderedDict()
+MAX_CACHED_MODELS = 4
+
+def _descriptor_from_state_dict(sd):
+    upscale_model = ModelLoader().load_from_state_dict(sd).eval()
+    if not isinstance(upscale_model, ImageModelDescriptor):
+        raise Exception("Upscale model must be a single-image model.")
+    return upscale_model
+
+def load_upscale_model(model_path, precision="fp32", device=None):
+    """Load the model at the precision it will run in; only that dtype is kept in the cache."""
+    mtime = os.path.getmtime(model_path)
+
+    # The file changed on disk: drop the stale entries
+    for stale in [k for k in _MODEL_CACHE if k[0] == model_path and k[1] != mtime]:
+        del _MODEL_CACHE[stale]
+
+    # Supported precisions are a property of the architecture, so any cached
+    # entry of this file can resolve the dtype before deciding to load
+    same_file = [k for k in _MODEL_CACHE if k[:2] == (model_path, mtime)]
+    if same_file:
+        dtype = resolve_precision(_MODEL_CACHE[same_file[-1]][0], precision, device)
+        key = (model_path, mtime, dtype)
+        if key in _MODEL_CACHE:
+            _MODEL_CACHE.move_to_end(key)
+            return _MODEL_CACHE[key]
+
+    fp32_key = (model_path, mtime, torch.float32)
+    if fp32_key in _MODEL_CACHE:
+        # Rebuild from the cached fp32 weights, copied to the CPU so a model
+        # left on the GPU by load_models_gpu is not duplicated in VRAM.
+        # Half-precision entries are never used as a source: their weights are already rounded.
+        source = _MODEL_CACHE[fp32_key][0]
+        sd = {k: v.to("cpu") for k, v in source.model.state_dict().items()}
+        upscale_model = _descriptor_from_state_dict(sd)
+    else:
+        sd = comfy.utils.load_torch_file(model_path, safe_load=True)
+        if "module.layers.0.residual_group.blocks.0.norm1.weight" in sd:
+            sd = comfy.utils.state_dict_prefix_replace(sd, {"module.":""})
+        upscale_model = _descriptor_from_state_dict(sd)
+
+    dtype = resolve_precision(upscale_model, precision, device)
+    key = (model_path, mtime, dtype)
+    if dtype != torch.float32:
+        upscale_model.to(dtype)
+
+    patcher = comfy.model_patcher.ModelPatcher(
+        upscale_model.model,
+        load_device=model_management.get_torch_device(),
+        offload_device=model_management.unet_offload_device(),
+    )
+    _MODEL_CACHE[key] = (upscale_model, patcher)
+    while len(_MODEL_CACHE) > MAX_CACHED_MODELS:
+        _MODEL_CACHE.popitem(last=False)
+    return upscale_model, patcher
+
+# Inference precision
+PRECISIONS = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+def resolve_precision(upscale_model, precision, device):
+    """Map the precision option to a dtype the architecture supports."""
+    if precision == "auto":
+        if upscale_model.supports_bfloat16 and model_management.should_use_bf16(device):
+            return torch.bfloat16
+        if upscale_model.supports_half and model_management.should_use_fp16(device):
+            return torch.float16
+        return torch.float32
+    dtype = PRECISIONS[precision]
+    if (dtype == torch.float16 and not upscale_model.supports_half) or (dtype == torch.bfloat16 and not upscale_model.supports_bfloat16):
+        logging.warning(f"Upscale Image with Model: {upscale_model.architecture.name} does not support {precision}, using fp32.")
+        return torch.float32
+    return dtype
+
+# Tile-size autotuning: the measured activation memory per input pixel is stored
+# per (model, architecture, scale, device, dtype) so later runs skip probing and OOM retries.
+TILE_CACHE_PATH = os.path.join(folder_paths.get_user_directory(), "ComfyUI-YarvixPA", "upscale_tile_cache.json")
+PROBE_TILE = 256
+MIN_TILE = 128
+MAX_TILE = 8192
+TILE_MEMORY_FRACTION = 0.8
+
+def _load_tile_cache():
+    try:
+        with open(TILE_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_tile_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(TILE_CACHE_PATH), exist_ok=True)
+        with open(TILE_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        logging.warning(f"Upscale Image with Model: could not write tile cache: {e}")
+
+def tile_cache_key(model_path, upscale_model, device):
+    return "|".join([os.path.basename(model_path), upscale_model.architecture.name,
+                     str(upscale_model.scale), str(device), str(upscale_model.dtype)])
+
+def default_bytes_per_pixel(upscale_model, element_size):
+    # Same heuristic as the fixed 512x512 estimate, expressed per input pixel
+    return 3 * element_size * max(upscale_model.scale, 1.0) * 384.0
+
+def measure_bytes_per_pixel(upscale_model, device, channels=3):
+    """Run one probe tile and measure the peak activation memory it needs."""
+    if device.type != "cuda":
+        return None
+    probe = torch.zeros((1, channels, PROBE_TILE, PROBE_TILE), device=device, dtype=upscale_model.dtype)
+    torch.cuda.synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    base = torch.cuda.memory_allocated(device)
+    with torch.no_grad():
+        upscale_model(probe)
+    peak = torch.cuda.max_memory_allocated(device) - base
+    del probe
+    return max(peak, 1) / (PROBE_TILE * PROBE_TILE)
+
+def pick_tile_size(bytes_per_pixel, device, height, width):
+    """Largest tile (multiple of 64) whose estimated memory fits in the free VRAM."""
+    free = model_management.get_free_memory(device) * TILE_MEMORY_FRACTION
+    tile = int(math.sqrt(free / bytes_per_pixel)) // 64 * 64
+    # No point in a tile larger than the image itself
+    tile = min(tile, math.ceil(max(height, width) / 8) * 8)
+    return max(MIN_TILE, min(tile, MAX_TILE))
+
+# Batched tiling: same tile layout and feathering as comfy.utils.tiled_scale, but several
+# tiles (possibly from different images) go through the model in one forward call.
+MAX_TILE_BATCH = 16
+
+def _tile_starts(size, tile, overlap):
+    if size <= tile:
+        return [0]
+    return [max(0, min(size - overlap, it)) for it in range(0, size - overlap, tile - overlap)]
+
+def _feather_mask(ps, feather):
+    mask = torch.ones_like(ps)
+    for d in (2, 3):
+        if feather >= mask.shape[d]:
+            continue
+        for t in range(feather):
+            a = (t + 1) / feather
+            mask.narrow(d, t, 1).mul_(a)
+            mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
+    return mask
+
+@torch.inference_mode()
+def tiled_scale_batched(samples, function, tile, overlap, scale, out_channels=3, output_device="cpu", max_batch=1, pbar=None, out_scale=None):
+    """
+    Drop-in for comfy.utils.tiled_scale that forwards up to `max_batch` same-sized tiles at once.
+    With `out_scale` set, each tile is resampled to that scale before blending, so the model-scale
+    image is never materialized and device memory only depends on the tile size.
+    """
+    out_scale = scale if out_scale is None else out_scale
+    b, _, h, w = samples.shape
+    output = torch.empty((b, out_channels, round(h * out_scale), round(w * out_scale)), device=output_device)
+    feather = round(overlap * out_scale)
+
+    def resample(ps, y, x, th, tw):
+        if out_scale == scale:
+            return ps
+        return comfy.utils.common_upscale(
+            ps,
+            width=round((x + tw) * out_scale) - round(x * out_scale),
+            height=round((y + th) * out_scale) - round(y * out_scale),
+            upscale_method="lanczos",
+            crop="disabled",
+        )
+
+    # Work list in the same order tiled_scale visits tiles: (image, y, x, tile_h, tile_w, whole_image)
+    work = []
+    for i in range(b):
+        if h <= tile and w <= tile:
+            work.append((i, 0, 0, h, w, True))
+            continue
+        for y in _tile_starts(h, tile, overlap):
+            for x in _tile_starts(w, tile, overlap):
+                work.append((i, y, x, min(tile, h - y), min(tile, w - x), False))
+
+    acc = {}
+    for start in range(0, len(work), max_batch):
+        chunk = work[start:start + max_batch]
+
+        # Forward same-sized tiles together
+        results = [None] * len(chunk)
+        groups = {}
+        for n, (i, y, x, th, tw, _) in enumerate(chunk):
+            groups.setdefault((th, tw), []).append(n)
+        for (th, tw), members in groups.items():
+            batch = torch.cat([samples[chunk[n][0]:chunk[n][0] + 1, :, chunk[n][1]:chunk[n][1] + th, chunk[n][2]:chunk[n][2] + tw] for n in members])
+            ps_batch = function(batch)
+            for k, n in enumerate(members):
+                i, y, x, th, tw, _ = chunk[n]
+                results[n] = resample(ps_batch[k:k + 1], y, x, th, tw).to(output_device)
+
+        # Scatter back in the original order so the blending matches tiled_scale exactly
+        for (i, y, x, th, tw, whole), ps in zip(chunk, results):
+            if whole:
+                output[i:i + 1] = ps
+            else:
+                # Blend straight into the output; the feather weights are the same for every
+                # channel, so a 1-channel buffer holds their sum
+                if i not in acc:
+                    output[i:i + 1].zero_()
+                    acc[i] = torch.zeros((1, 1) + output.shape[2:], device=output_device)
+                mask = _feather_mask(ps[:, :1], feather)
+                oy, ox = round(y * out_scale), round(x * out_scale)
+                output[i:i + 1, :, oy:oy + mask.shape[2], ox:ox + mask.shape[3]].add_(ps * mask)
+                acc[i][:, :, oy:oy + mask.shape[2], ox:ox + mask.shape[3]].add_(mask)
+            if pbar is not None:
+                pbar.update(1)
+
+        # Finalize images whose tiles are all done
+        last_image = chunk[-1][0]
+        for i in [i for i in acc if i < last_image or start + max_batch >= len(work)]:
+            output[i:i + 1].div_(acc.pop(i))
+    return output
+
 class UpscaleImageWithModel:
     @classmethod
     def INPUT_TYPES(s):
@@ -27,6 +251,12 @@ class UpscaleImageWithModel:
                 "tile_size": (
                     "INT", {"default": 512, "min": 128, "max": 8192, "step": 8},  # Control for tile size
                 )
+            },
+            "optional": {
+                "auto_tile_size": ("BOOLEAN", {"default": False, "tooltip": "Pick the largest tile that fits in free VRAM from a measured per-pixel memory cost (cached on disk per model, device and dtype). Overrides tile_size."}),
+                "precision": (["fp32", "auto", "fp16", "bf16"], {"default": "fp32", "tooltip": "Inference precision. Half precisions are only used when the architecture supports them; auto picks bf16, then fp16, when the device handles them well."}),
+                "batch_tiles": ("BOOLEAN", {"default": False, "tooltip": "Run several tiles (from one or more images) per forward call, as many as fit in free VRAM. Output matches the one-tile-at-a-time path."}),
+                "stream_output": ("BOOLEAN", {"default": False, "tooltip": "Resize each tile to the final upscale_by size and write it straight into the output on the CPU. Peak VRAM then depends on the tile size, not the output size."}),
             }
         }
 
@@ -35,54 +265,85 @@ class UpscaleImageWithModel:
     CATEGORY = "ComfyUI-YarvixPA/Image/Upscale"
     DESCRIPTION = "Upscales an image using a specified model, with options for scaling factor and tiling."
 
-    def upscale_image(self, model_name, upscale_by, image, tile_size):
-        # Load the selected model
+    def upscale_image(self, model_name, upscale_by, image, tile_size, auto_tile_size=False, batch_tiles=False, precision="fp32", stream_output=False):
+        # Load the selected model (reused from the cache when the file is unchanged)
         model_path = folder_paths.get_full_path("upscale_models", model_name)
-        sd = comfy.utils.load_torch_file(model_path, safe_load=True)
-        if "module.layers.0.residual_group.blocks.0.norm1.weight" in sd:
-            sd = comfy.utils.state_dict_prefix_replace(sd, {"module.":""})
-        upscale_model = ModelLoader().load_from_state_dict(sd).eval()
+        upscale_model, patcher = load_upscale_model(model_path, precision, model_management.get_torch_device())
+        device = patcher.load_device
+        dtype = upscale_model.dtype
 
-        if not isinstance(upscale_model, ImageModelDescriptor):
-            raise Exception("Upscale model must be a single-image model.")
-        
-        device = model_management.get_torch_device()
+        tile_cache = _load_tile_cache() if auto_tile_size else {}
+        tuner_key = tile_cache_key(model_path, upscale_model, device)
+        bytes_per_pixel = tile_cache.get(tuner_key) or default_bytes_per_pixel(upscale_model, image.element_size())
 
-        memory_required = model_management.module_size(upscale_model.model)
-        memory_required += (512 * 512 * 3) * image.element_size() * max(upscale_model.scale, 1.0) * 384.0  # Memory estimate
+        # Let ComfyUI place the model; it can unload it again under memory pressure
+        memory_required = (512 * 512) * bytes_per_pixel  # Memory estimate
         memory_required += image.nelement() * image.element_size()
-        model_management.free_memory(memory_required, device)
+        model_management.load_models_gpu([patcher], memory_required=memory_required, force_full_load=True)
 
-        upscale_model.to(device)
-        in_img = image.movedim(-1, -3).to(device)
+        # When streaming, the input stays on the CPU and only tiles are moved to the device
+        in_img = image.movedim(-1, -3)
+        if not stream_output:
+            in_img = in_img.to(device)
+
+        if auto_tile_size:
+            if tuner_key not in tile_cache:
+                measured = measure_bytes_per_pixel(upscale_model, device, in_img.shape[1])
+                if measured is not None:
+                    bytes_per_pixel = tile_cache[tuner_key] = measured
+                    _save_tile_cache(tile_cache)
+            tile_size = pick_tile_size(bytes_per_pixel, device, in_img.shape[2], in_img.shape[3])
+            logging.info(f"Upscale Image with Model: auto tile size {tile_size} ({bytes_per_pixel:.0f} bytes/pixel)")
 
         overlap = 32  # Keep the original overlap value
 
+        tile_batch = 1
+        if batch_tiles:
+            free = model_management.get_free_memory(device) * TILE_MEMORY_FRACTION
+            tile_batch = max(1, min(MAX_TILE_BATCH, int(free // (bytes_per_pixel * tile_size * tile_size))))
+
+        # Inputs are cast per tile and outputs back to fp32, so no full-size copies are made
+        def run_model(a):
+            return upscale_model(a.to(device=device, dtype=dtype)).float()
+
         oom = True
         while oom:
             try:
                 steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile_size, tile_y=tile_size, overlap=overlap)
                 pbar = comfy.utils.ProgressBar(steps)
-                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile_size, tile_y=tile_size, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar)
-                
-                # Adjust according to the upscale_by value
-                size_diff = upscale_by / upscale_model.scale
-                if size_diff != 1:
-                    s = comfy.utils.common_upscale(
-                        s,
-                        width=round(s.shape[3] * size_diff),
-                        height=round(s.shape[2] * size_diff),
-                        upscale_method="lanczos",
-                        crop="disabled",
-                    )
+                if stream_output:
+                    s = tiled_scale_batched(in_img, run_model, tile_size, overlap, upscale_model.scale, max_batch=tile_batch, pbar=pbar, out_scale=upscale_by)
+                else:
+                    if tile_batch > 1:
+                        s = tiled_scale_batched(in_img, run_model, tile_size, overlap, upscale_model.scale, max_batch=tile_batch, pbar=pbar)
+                    else:
+                        s = comfy.utils.tiled_scale(in_img, run_model, tile_x=tile_size, tile_y=tile_size, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar)
+
+                    # Adjust according to the upscale_by value
+                    size_diff = upscale_by / upscale_model.scale
+                    if size_diff != 1:
+                        s = comfy.utils.common_upscale(
+                            s,
+                            width=round(s.shape[3] * size_diff),
+                            height=round(s.shape[2] * size_diff),
+                            upscale_method="lanczos",
+                            crop="disabled",
+                        )
                 oom = False
             except model_management.OOM_EXCEPTION as e:
+                # Shrink the tile batch first, then the tiles themselves
+                if tile_batch > 1:
+                    tile_batch //= 2
+                    continue
                 tile_size //= 2
                 if tile_size < 128:
                     raise e
+                if auto_tile_size:
+                    # The estimate was too optimistic: remember a cost that yields the smaller tile
+                    tile_cache[tuner_key] = bytes_per_pixel = bytes_per_pixel * 4
+                    _save_tile_cache(tile_cache)
 
-        upscale_model.to("cpu")
-        s = torch.clamp(s.movedim(-3, -1), min=0, max=1.0)
+        s = s.clamp_(min=0, max=1.0).movedim(-3, -1)
         return (s,)
 
 NODE_CLASS_MAPPINGS = {
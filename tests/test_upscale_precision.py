@@ -0,0 +1,146 @@
+"""
+Precision handling of Upscale Image with Model.
+
+Loads the node module with small stand-ins for ComfyUI's `comfy` and
+`folder_paths` modules, then checks load_upscale_model / resolve_precision
+on a tiny spandrel model: half-precision output stays close to fp32, the
+checkpoint is parsed once per needed source, and fp32 weights never come
+from a half-precision copy.
+"""
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("spandrel")
+
+from spandrel.architectures.Compact import SRVGGNetCompact
+
+NODE_PATH = Path(__file__).resolve().parents[1] / "nodes" / "Image" / "Upscale" / "upscale_image_with_model.py"
+# Max error relative to the fp32 output range
+TOLERANCE = {torch.float16: 1e-2, torch.bfloat16: 5e-2}
+
+
+class _ModelPatcher:
+    def __init__(self, model, load_device=None, offload_device=None):
+        self.model = model
+        self.load_device = load_device
+        self.offload_device = offload_device
+
+
+@pytest.fixture
+def upscale(monkeypatch, tmp_path):
+    """The node module, freshly imported against stub ComfyUI modules, plus a load counter."""
+    loads = []
+
+    def load_torch_file(path, safe_load=True):
+        loads.append(path)
+        return torch.load(path, weights_only=True)
+
+    model_management = types.SimpleNamespace(
+        get_torch_device=lambda: torch.device("cpu"),
+        unet_offload_device=lambda: torch.device("cpu"),
+        should_use_fp16=lambda device=None: True,
+        should_use_bf16=lambda device=None: False,
+        get_free_memory=lambda device=None: 1 << 30,
+        OOM_EXCEPTION=torch.cuda.OutOfMemoryError,
+    )
+    utils = types.SimpleNamespace(load_torch_file=load_torch_file,
+                                  state_dict_prefix_replace=lambda sd, prefixes: sd)
+    comfy = types.ModuleType("comfy")
+    comfy.model_management = model_management
+    comfy.utils = utils
+    comfy.model_patcher = types.SimpleNamespace(ModelPatcher=_ModelPatcher)
+    folder_paths = types.SimpleNamespace(get_user_directory=lambda: str(tmp_path))
+
+    monkeypatch.setitem(sys.modules, "comfy", comfy)
+    monkeypatch.setitem(sys.modules, "comfy.model_management", model_management)
+    monkeypatch.setitem(sys.modules, "comfy.utils", utils)
+    monkeypatch.setitem(sys.modules, "comfy.model_patcher", comfy.model_patcher)
+    monkeypatch.setitem(sys.modules, "folder_paths", folder_paths)
+
+    spec = importlib.util.spec_from_file_location("upscale_image_with_model_under_test", NODE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, loads
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    torch.manual_seed(0)
+    net = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=16, num_conv=4, upscale=2, act_type="prelu")
+    path = tmp_path / "tiny_compact.pth"
+    torch.save(net.state_dict(), path)
+    return str(path), net.state_dict()
+
+
+def _weights(descriptor):
+    return descriptor.model.state_dict()
+
+
+def test_resolve_precision(upscale, checkpoint):
+    module, _ = upscale
+    model, _ = module.load_upscale_model(checkpoint[0])
+    cpu = torch.device("cpu")
+    assert module.resolve_precision(model, "fp32", cpu) == torch.float32
+    assert module.resolve_precision(model, "fp16", cpu) == torch.float16
+    assert module.resolve_precision(model, "bf16", cpu) == torch.bfloat16
+    # The stub reports fp16 as preferred and bf16 as unsupported by the device
+    assert module.resolve_precision(model, "auto", cpu) == torch.float16
+
+
+def test_half_precision_derived_from_cached_fp32_without_reparsing(upscale, checkpoint):
+    module, loads = upscale
+    path, original = checkpoint
+    fp32, _ = module.load_upscale_model(path, "fp32")
+    fp16, _ = module.load_upscale_model(path, "fp16")
+
+    assert len(loads) == 1
+    assert fp32.dtype == torch.float32 and fp16.dtype == torch.float16
+    for name, tensor in _weights(fp16).items():
+        assert torch.equal(tensor, original[name].to(torch.float16))
+    # The fp32 entry itself is left untouched
+    for name, tensor in _weights(fp32).items():
+        assert torch.equal(tensor, original[name])
+
+
+def test_fp32_after_fp16_is_not_rounded(upscale, checkpoint):
+    module, loads = upscale
+    path, original = checkpoint
+    module.load_upscale_model(path, "fp16")
+    fp32, _ = module.load_upscale_model(path, "fp32")
+
+    # fp32 cannot be derived from the rounded fp16 weights, so the file is parsed again
+    assert len(loads) == 2
+    for name, tensor in _weights(fp32).items():
+        assert tensor.dtype == torch.float32
+        assert torch.equal(tensor, original[name])
+
+
+def test_cached_precision_is_reused(upscale, checkpoint):
+    module, loads = upscale
+    first = module.load_upscale_model(checkpoint[0], "fp16")
+    again = module.load_upscale_model(checkpoint[0], "fp16")
+    assert again[0] is first[0] and len(loads) == 1
+
+
+@pytest.mark.parametrize("precision,dtype", [("fp16", torch.float16), ("bf16", torch.bfloat16)])
+def test_half_precision_output_matches_fp32(upscale, checkpoint, precision, dtype):
+    module, _ = upscale
+    fp32, _ = module.load_upscale_model(checkpoint[0], "fp32")
+    half, _ = module.load_upscale_model(checkpoint[0], precision)
+    image = torch.rand((1, 3, 32, 32), generator=torch.Generator().manual_seed(1))
+
+    with torch.no_grad():
+        reference = fp32(image).float()
+        try:
+            out = half(image.to(dtype)).float()
+        except RuntimeError as e:
+            pytest.skip(f"{precision} inference is not supported on this CPU build: {e}")
+
+    assert out.shape == reference.shape
+    drift = (out - reference).abs().max() / reference.abs().max().clamp_min(1e-6)
+    assert drift.item() < TOLERANCE[dtype]
@@ -0,0 +1,7 @@
+"""
+Helpers shared by several node modules.
+
+Node files are loaded one by one from `nodes/` and cannot import each
+other, so common code lives here. The root __init__.py registers this
+directory as the top-level package `yarvixpa_shared` before loading nodes.
+"""
@@ -0,0 +1,328 @@
+import logging
+import time
+
+import torch
+import torch.nn.functional as F
+
+import comfy.model_management as model_management
+
+from . import latent_cache
+
+
+# Images thresholded per step in fill_masked, bounding its bool mask temporary.
+MASK_CHUNK = 16
+
+# How images are encoded: "auto" is ComfyUI's vae.encode, which retries
+# tiled by itself on OOM; "tiled" always uses vae.encode_tiled.
+ENCODE_MODES = ["auto", "tiled"]
+DEFAULT_TILE_SIZE = 512
+MIN_TILE_SIZE = 128
+
+# Counters for the encode engine, accumulated across runs and logged after every encode.
+ENCODE_STATS = {
+    "calls": 0,            # encode_many() calls
+    "images": 0,           # images requested
+    "deduplicated": 0,     # requests served by another identical request
+    "vae_calls": 0,        # batched vae.encode() calls actually made
+    "empty_masks": 0,      # inpaint encodes whose mask was empty (no masked copy made)
+    "full_encodes": 0,     # vae.encode() calls that ran untiled
+    "fallback_encodes": 0, # vae.encode() calls that ComfyUI retried tiled after an OOM
+    "tiled_encodes": 0,    # our vae.encode_tiled() calls (explicit or after a failed fallback)
+    "last_tile": 0,        # tile size of the last tiled encode
+    "mask_seconds": 0.0,
+    "encode_seconds": 0.0,
+}
+
+
+def stats_report():
+    s = ENCODE_STATS
+    tiled = f"{s['tiled_encodes']} tiled"
+    if s["tiled_encodes"]:
+        tiled += f" at {s['last_tile']}px"
+    return (f"{s['images']} images in {s['calls']} calls -> {s['vae_calls']} VAE encodes "
+            f"({s['full_encodes']} full, {s['fallback_encodes']} tiled by ComfyUI, {tiled}; "
+            f"{s['deduplicated']} deduplicated, {s['empty_masks']} empty masks), "
+            f"mask {s['mask_seconds'] * 1000:.1f} ms, encode {s['encode_seconds'] * 1000:.1f} ms")
+
+
+def _batchable(vae):
+    # Video VAEs fold an image batch into the frames of one clip, so their
+    # inputs have to be encoded one by one to stay independent.
+    return getattr(vae, "latent_dim", 2) == 2 or getattr(vae, "not_video", False)
+
+
+def _signature(t):
+    # Two requests with the same view of the same storage are the same image
+    return (t.data_ptr(), tuple(t.shape), t.stride(), t.dtype, t.device)
+
+
+class _TiledFallbackWatcher(logging.Handler):
+    """Notices the warning VAE.encode logs when it retries with tiled encoding after an OOM."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.tiled = False
+
+    def emit(self, record):
+        if "tiled VAE encoding" in record.getMessage():
+            self.tiled = True
+
+
+def _join(parts):
+    """
+    The parts stacked along the batch dimension. When they already lie back to
+    back in one contiguous storage (see prepare_inpaint) this is a view
+    over them instead of a torch.cat copy.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    first = parts[0]
+    storage = first.untyped_storage().data_ptr()
+    offset = first.storage_offset()
+    for part in parts:
+        if (not part.is_contiguous() or part.untyped_storage().data_ptr() != storage
+                or part.storage_offset() != offset):
+            return torch.cat(parts)
+        offset += part.nelement()
+    shape = (sum(part.shape[0] for part in parts),) + tuple(first.shape[1:])
+    return first.as_strided(shape, first.stride(), first.storage_offset())
+
+
+def _encode_tiled(vae, batch, tile_size):
+    """vae.encode_tiled(), halving the tile until it fits in memory. Returns (latent, tile)."""
+    tile = max(MIN_TILE_SIZE, min(tile_size, max(batch.shape[1], batch.shape[2])) // 64 * 64)
+    while True:
+        try:
+            latent = vae.encode_tiled(batch, tile_x=tile, tile_y=tile, overlap=tile // 8)
+            break
+        except model_management.OOM_EXCEPTION:
+            if tile <= MIN_TILE_SIZE:
+                raise
+            tile = max(MIN_TILE_SIZE, tile // 2)
+            model_management.soft_empty_cache()
+            logging.warning(f"VAE Encode: out of memory, retrying with {tile}px tiles")
+    ENCODE_STATS["tiled_encodes"] += 1
+    ENCODE_STATS["last_tile"] = tile
+    return latent, tile
+
+
+def _encode(vae, batch, mode="auto", tile_size=DEFAULT_TILE_SIZE):
+    """
+    One VAE encode call, returning (latent, path) where path names how it ran.
+
+    "auto" uses vae.encode, which already falls back to tiled encoding on
+    OOM; that fallback is detected from its log warning. Should the
+    fallback run out of memory too, tiles are halved from `tile_size`.
+    """
+    if mode == "tiled":
+        latent, tile = _encode_tiled(vae, batch, tile_size)
+        return latent, f"tiled {tile}px"
+
+    watcher = _TiledFallbackWatcher()
+    root = logging.getLogger()
+    root.addHandler(watcher)
+    try:
+        latent = vae.encode(batch)
+    except model_management.OOM_EXCEPTION:
+        model_management.soft_empty_cache()
+        logging.warning("VAE Encode: out of memory in ComfyUI's tiled fallback, retrying with smaller tiles")
+        latent, tile = _encode_tiled(vae, batch, tile_size // 2)
+        return latent, f"tiled {tile}px after OOM"
+    finally:
+        root.removeHandler(watcher)
+
+    if watcher.tiled:
+        ENCODE_STATS["fallback_encodes"] += 1
+        return latent, "tiled by ComfyUI after OOM"
+    ENCODE_STATS["full_encodes"] += 1
+    return latent, "full"
+
+
+def encode_many(vae, images, mode="auto", tile_size=DEFAULT_TILE_SIZE):
+    """
+    Encode a list of IMAGE tensors, returning one latent per image in order.
+
+    Requests for the same tensor view are encoded once, and images of the
+    same shape go through vae.encode together as one batch, then the
+    result is sliced back per request. `mode` picks the encode path, see
+    _encode(); the path each call took is logged with the running totals.
+    """
+    ENCODE_STATS["calls"] += 1
+    ENCODE_STATS["images"] += len(images)
+
+    latents = [None] * len(images)
+    first = {}
+    groups = {}
+    batchable = _batchable(vae)
+    for n, image in enumerate(images):
+        sig = _signature(image)
+        if sig in first:
+            ENCODE_STATS["deduplicated"] += 1
+            continue
+        first[sig] = n
+        group = (tuple(image.shape[1:]), image.dtype) if batchable else n
+        groups.setdefault(group, []).append(n)
+
+    paths = []
+    start = time.perf_counter()
+    for members in groups.values():
+        # vae.encode loads the VAE and splits the batch by its own memory estimate
+        batch = _join([images[m] for m in members])
+        encoded, path = _encode(vae, batch, mode, tile_size)
+        ENCODE_STATS["vae_calls"] += 1
+        paths.append(f"{batch.shape[2]}x{batch.shape[1]} x{batch.shape[0]} {path}")
+        offset = 0
+        for m in members:
+            count = images[m].shape[0]
+            latents[m] = encoded[offset:offset + count]
+            offset += count
+    ENCODE_STATS["encode_seconds"] += time.perf_counter() - start
+    if paths:
+        logging.info(f"VAE Encode: {'; '.join(paths)} | totals: {stats_report()}")
+
+    for n, image in enumerate(images):
+        if latents[n] is None:
+            latents[n] = latents[first[_signature(image)]]
+    return latents
+
+
+def encode_cached(vae, images, budget_mb=0, persist=False, mode="auto", tile_size=DEFAULT_TILE_SIZE, **params):
+    """
+    encode_many() behind the shared latent cache.
+
+    Each image is looked up by VAE weights, image content and `params`
+    (crop parameters and the like); only the misses are encoded, and they
+    are stored back within the `budget_mb` RAM budget (and on disk with
+    `persist`). A budget of 0 without `persist` skips the cache entirely.
+    Cached latents are reused whichever encode path produced them.
+    """
+    if budget_mb <= 0 and not persist:
+        return encode_many(vae, images, mode, tile_size)
+
+    keys = []
+    digests = {}
+    for image in images:
+        sig = _signature(image)
+        if sig not in digests:
+            digests[sig] = latent_cache.cache_key(vae, image, **params)
+        keys.append(digests[sig])
+
+    found = {key: latent_cache.lookup(key, persist, budget_mb) for key in dict.fromkeys(keys)}
+    misses = [keys.index(key) for key, latent in found.items() if latent is None]
+    for n, latent in zip(misses, encode_many(vae, [images[n] for n in misses], mode, tile_size)):
+        found[keys[n]] = latent
+        latent_cache.remember(keys[n], latent, budget_mb, persist)
+
+    logging.info(f"Latent Cache: {latent_cache.cache_report()}")
+    return [found[key] for key in keys]
+
+
+def _snap_span(first, last, padding, limit):
+    """Padded [start, end) around rows/cols first..last, on the 8-px grid and inside [0, limit)."""
+    end = min(limit, -(-(last + 1 + padding) // 8) * 8)
+    start = min(max(0, (first - padding) // 8 * 8), end - 8)
+    return start, end
+
+
+def crop_region(pixels, mask, padding=None):
+    """
+    Cut pixels and mask down to the region that will be encoded.
+
+    With `padding` None the region is the centred 8-px-grid crop of the full
+    image. Otherwise it is the bounding box of the mask across the batch,
+    grown by `padding` pixels of context and snapped to the 8-px grid; an
+    empty mask falls back to the full crop. Returns (pixels, mask, crop) where
+    `crop` describes the region for stitching the decoded result back.
+    """
+    height, width = pixels.shape[1], pixels.shape[2]
+    h, w = (height // 8) * 8, (width // 8) * 8
+    mask = F.interpolate(mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])),
+                         size=(height, width), mode="bilinear")
+
+    hard = mask[:, :, :h, :w].round() if padding is not None else None
+    if hard is not None and hard.any():
+        rows = hard.amax(dim=(0, 1, 3)).nonzero()
+        cols = hard.amax(dim=(0, 1, 2)).nonzero()
+        top, bottom = _snap_span(int(rows[0]), int(rows[-1]), padding, h)
+        left, right = _snap_span(int(cols[0]), int(cols[-1]), padding, w)
+    else:
+        top, left = (height % 8) // 2, (width % 8) // 2
+        bottom, right = top + h, left + w
+
+    mask = mask[:, :, top:bottom, left:right]
+    crop = {
+        "box": (top, left, bottom, right),
+        "size": (height, width),
+        "mask": mask.squeeze(1),
+    }
+    return pixels[:, top:bottom, left:right, :], mask, crop
+
+
+def prepare_inpaint(pixels, mask):
+    """
+    Crop pixels and mask to the 8-px grid and blank the masked area to grey.
+
+    Returns (original, masked, mask) where `original` is the cropped RGB
+    image, `masked` the image fed to concat_latent_image and `mask` the
+    resized, cropped mask. With an empty mask `masked` is `original` itself
+    and nothing is copied; otherwise both are halves of one buffer, laid out
+    [masked | original] so encode_many can pass them to the VAE as a
+    single batch without concatenating.
+    """
+    start = time.perf_counter()
+    h, w = (pixels.shape[1] // 8) * 8, (pixels.shape[2] // 8) * 8
+    mask = mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1]))
+    if mask.shape[-2:] != pixels.shape[1:3]:
+        mask = F.interpolate(mask, size=(pixels.shape[1], pixels.shape[2]), mode="bilinear")
+
+    original = pixels[:, :, :, :3]
+    if pixels.shape[1] != h or pixels.shape[2] != w:
+        h_off, w_off = (pixels.shape[1] % 8) // 2, (pixels.shape[2] % 8) // 2
+        original = original[:, h_off:h + h_off, w_off:w + w_off, :]
+        mask = mask[:, :, h_off:h + h_off, w_off:w + w_off]
+
+    # Same test as mask.round() for values in [0, 1], without a temporary
+    if mask.amax() <= 0.5:
+        ENCODE_STATS["empty_masks"] += 1
+        ENCODE_STATS["mask_seconds"] += time.perf_counter() - start
+        return original, original, mask
+
+    masked_count = max(original.shape[0], mask.shape[0])
+    buffer = torch.empty((masked_count + original.shape[0],) + tuple(original.shape[1:]),
+                         dtype=original.dtype, device=original.device)
+    masked, kept = buffer[:masked_count], buffer[masked_count:]
+    kept.copy_(original)
+    fill_masked(masked, kept, mask)
+    ENCODE_STATS["mask_seconds"] += time.perf_counter() - start
+    return kept, masked, mask
+
+
+def fill_masked(out, original, mask, chunk=MASK_CHUNK):
+    """
+    Write `original` into `out` with the pixels where mask > 0.5 greyed to 0.5.
+
+    Equivalent to (original - 0.5) * (1 - mask.round()) + 0.5, but done in
+    place in the image dtype (float16 batches stay float16). The bool mask
+    is built `chunk` images at a time, so its temporary stays bounded.
+    """
+    out.copy_(original.expand_as(out))
+    if mask.shape[0] == 1:
+        out.masked_fill_((mask > 0.5).movedim(1, -1), 0.5)
+        return out
+    for i in range(0, out.shape[0], chunk):
+        out[i:i + chunk].masked_fill_((mask[i:i + chunk] > 0.5).movedim(1, -1), 0.5)
+    return out
+
+
+def inpaint_encode(vae, pixels, mask, cache_mb=0, mode="auto", tile_size=DEFAULT_TILE_SIZE, **params):
+    """
+    Masked and original latents for inpaint conditioning, from one batched VAE call.
+
+    With `cache_mb` > 0 both latents go through the shared latent cache,
+    keyed additionally by `params` (the crop box); `mode` and `tile_size`
+    choose between full and tiled VAE encoding. Returns
+    (concat_latent, orig_latent, mask).
+    """
+    original, masked, mask = prepare_inpaint(pixels, mask)
+    concat_latent, orig_latent = encode_cached(vae, [masked, original], cache_mb, False, mode, tile_size, **params)
+    return concat_latent, orig_latent, mask
@@ -0,0 +1,126 @@
+import os
+import hashlib
+import weakref
+from collections import OrderedDict
+
+import torch
+from safetensors.torch import load_file, save_file
+
+import folder_paths
+
+
+# Content-addressed LRU of VAE latents shared by every node that encodes
+# images, keyed by (VAE weights hash, image content hash, crop parameters).
+_ENCODE_CACHE = OrderedDict()
+_VAE_DIGESTS = weakref.WeakKeyDictionary()
+DEFAULT_CACHE_MB = 1024
+DISK_CACHE_DIR = os.path.join(folder_paths.get_user_directory(), "ComfyUI-YarvixPA", "latent_cache")
+# Size cap of DISK_CACHE_DIR; the least recently used files are deleted past it.
+DISK_CACHE_MB = 4096
+
+CACHE_STATS = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_bytes():
+    return sum(t.nelement() * t.element_size() for t in _ENCODE_CACHE.values())
+
+
+def cache_report():
+    s = CACHE_STATS
+    lookups = s["hits"] + s["disk_hits"] + s["misses"]
+    rate = 100.0 * (s["hits"] + s["disk_hits"]) / lookups if lookups else 0.0
+    return (f"{s['hits']} hits, {s['disk_hits']} disk hits, {s['misses']} misses ({rate:.0f}% hit rate), "
+            f"{len(_ENCODE_CACHE)} latents / {cache_bytes() / (1024 * 1024):.1f} MB held, "
+            f"{s['evictions']} evicted")
+
+
+def _tensor_digest(t):
+    h = hashlib.sha1(f"{tuple(t.shape)}{t.dtype}".encode())
+    # reshape first: a dtype view needs dim > 0, and state dicts hold scalar buffers
+    h.update(t.detach().reshape(-1).contiguous().view(torch.uint8).cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+def _vae_digest(vae):
+    """Hash of the VAE weights, computed once per VAE object."""
+    digest = _VAE_DIGESTS.get(vae)
+    if digest is None:
+        h = hashlib.sha1()
+        for name, tensor in sorted(vae.first_stage_model.state_dict().items()):
+            h.update(name.encode())
+            h.update(_tensor_digest(tensor).encode())
+        digest = _VAE_DIGESTS[vae] = h.hexdigest()
+    return digest
+
+
+def cache_key(vae, image, **params):
+    """Key for encoding `image` with `vae`; `params` (e.g. a crop box) are folded in when given."""
+    key = f"{_vae_digest(vae)}:{_tensor_digest(image)}"
+    if params:
+        key += ":" + ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _store(key, latent, budget_bytes):
+    _ENCODE_CACHE[key] = latent
+    _ENCODE_CACHE.move_to_end(key)
+    total = cache_bytes()
+    # Evict least recently used latents, always keeping the newest one
+    while total > budget_bytes and len(_ENCODE_CACHE) > 1:
+        _, old = _ENCODE_CACHE.popitem(last=False)
+        total -= old.nelement() * old.element_size()
+        CACHE_STATS["evictions"] += 1
+
+
+def _prune_disk(limit_bytes=DISK_CACHE_MB * 1024 * 1024):
+    """Delete the least recently used files until DISK_CACHE_DIR fits in `limit_bytes`."""
+    try:
+        entries = [e for e in os.scandir(DISK_CACHE_DIR) if e.name.endswith(".safetensors")]
+    except OSError:
+        return
+    entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries)
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= limit_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def lookup(key, persist=False, budget_mb=DEFAULT_CACHE_MB):
+    """
+    Cached latent for `key` from RAM (or disk with `persist`), else None.
+    Disk hits are promoted into the RAM cache within `budget_mb`.
+    """
+    if key in _ENCODE_CACHE:
+        _ENCODE_CACHE.move_to_end(key)
+        CACHE_STATS["hits"] += 1
+        return _ENCODE_CACHE[key]
+    path = os.path.join(DISK_CACHE_DIR, f"{key}.safetensors")
+    if persist and os.path.exists(path):
+        CACHE_STATS["disk_hits"] += 1
+        latent = load_file(path)["latent"]
+        # Mark as recently used for _prune_disk
+        os.utime(path)
+        if budget_mb > 0:
+            _store(key, latent, budget_mb * 1024 * 1024)
+        return latent
+    CACHE_STATS["misses"] += 1
+    return None
+
+
+def remember(key, latent, budget_mb=DEFAULT_CACHE_MB, persist=False):
+    """Keep `latent` under `key` within a RAM budget of `budget_mb`, and on disk with `persist`."""
+    path = os.path.join(DISK_CACHE_DIR, f"{key}.safetensors")
+    if persist and not os.path.exists(path):
+        os.makedirs(DISK_CACHE_DIR, exist_ok=True)
+        save_file({"latent": latent.detach().cpu().contiguous()}, path)
+        _prune_disk()
+    if budget_mb > 0:
+        # Slices of a batched encode would keep the whole batch alive; hold a compact copy
+        if latent.untyped_storage().nbytes() > latent.nelement() * latent.element_size():
+            latent = latent.clone()
+        _store(key, latent, budget_mb * 1024 * 1024)